@@ -2,7 +2,8 @@
 
 from tenacity import retry, wait_exponential, stop_after_attempt
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QProgressBar, QLabel, QSpinBox, QInputDialog, QComboBox, QMessageBox)
+    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QProgressBar, QLabel, QSpinBox, QInputDialog, QComboBox, QMessageBox,
+    QCompleter)
 from PyQt5.QtWebEngineWidgets import QWebEngineView
 from PyQt5.QtGui import QColor
 from PyQt5.QtWebChannel import QWebChannel
@@ -13,11 +14,13 @@ from config_ import Config
 import requests
 import os, json
 import sqlite3
-from Tile_Downloader import download_panorama
+from download_pipeline import PanoramaPipeline
 from dotenv import load_dotenv
 from utils import resolve_path
 from pathlib import Path
 from Metadata_scanner_grid_search import StreetViewDensityScanner
+from metadata_db import connect as connect_metadata_db, connect_readonly, panoramas_in_bbox, panoramas_in_circle, panoramas_in_polygon
+from gazetteer import Gazetteer
 
 class CoordinateReceiver(QObject):
     # Emitted when JavaScript sends coordinates: list of [lat, lng] or list of lists
@@ -29,7 +32,7 @@ class CoordinateReceiver(QObject):
         self.coordinatesReceived.emit(coords)
 
 class StreetViewDownloader(QThread):
-    progress = pyqtSignal(int, int)  # current, total
+    progress = pyqtSignal(int, int, str)  # current, total, stage throughput
     finished = pyqtSignal()
 
     def __init__(self, output_dir, max_images, logger: Logger, config: Config, FOUND_COORDS: list[tuple[float,float]]):
@@ -44,21 +47,9 @@ class StreetViewDownloader(QThread):
 
     def run(self):
         try:
-            total = len(self.coords)
-            count = 0
-            for i, (lat, lng, pan_id) in enumerate(self.coords, 1):
-                if self.max_images and count >= self.max_images:
-                    self.logger.log_status(f"Reached max_images limit: {self.max_images}")
-                    break
-                try:
-                    self.logger.log_status(f"Requesting Street View for ({lat}, {lng})")
-                    download_panorama(pano_id=pan_id, save_dir=self.output_dir, coords=(lat, lng))
-                    count += 1
-                    self.logger.log_status(f"Saved image {self.region}_{lat}_{lng}")
-                except Exception as e:
-                    self.logger.log_exception(f"Failed to download at ({lat},{lng}): {e}")
-                self.progress.emit(i, total)
-            self.logger.log_status("Street View download finished")
+            self.pipeline = PanoramaPipeline(self.output_dir, logger=self.logger, db_path=self.config.get_database_path())
+            count = self.pipeline.run(self.coords, max_images=self.max_images, on_progress=self.progress.emit)
+            self.logger.log_status(f"Street View download finished: {count} panoramas saved")
         except Exception as e:
             self.logger.log_exception(f"Downloader thread failed: {e}")
         finally:
@@ -73,10 +64,18 @@ class ApiWindow(QWidget):
         print("Reached before set api key")
         QTimer.singleShot(0, lambda: self.set_api_key(self.secrets_path))
         self.DB_PATH = self.config.get_database_path()
+        # schema and migrations once here, so map selections only read
+        try:
+            connect_metadata_db(self.DB_PATH).close()
+        except sqlite3.Error as e:
+            self.logger.log_exception(f"Could not open metadata database {self.DB_PATH}: {e}")
         self.FOUND_COORDS = []
         self.region = self.config.get_general_data()["region"]
         self.output_dir = self.config.get_dwnd_file_path()
         os.makedirs(self.output_dir, exist_ok=True)
+        # City names and bounds are answered locally; Nominatim is only asked for cities missing bounds
+        self.gazetteer = Gazetteer(self.config.get_gazetteer_path())
+        self.gazetteer.sync(resolve_path("cities.txt"), self.config.get_map_index_path())
         self.setup_ui()
 
     def set_api_key(self, path:Path):
@@ -123,8 +122,12 @@ class ApiWindow(QWidget):
         top_layout.addWidget(self.city_dropdown)
 
         self.rect_btn = QPushButton("Rectangle Select")
+        self.circle_btn = QPushButton("Circle Select")
+        self.poly_btn = QPushButton("Polygon Select")
         self.clear_btn = QPushButton("Clear Selection")
         top_layout.addWidget(self.rect_btn)
+        top_layout.addWidget(self.circle_btn)
+        top_layout.addWidget(self.poly_btn)
         top_layout.addWidget(self.clear_btn)
 
         self.populate_city_dropdown()
@@ -158,8 +161,8 @@ class ApiWindow(QWidget):
 
         # Connect signals
         self.rect_btn.clicked.connect(lambda: self.run_js('enableRectangle()'))
-        # self.circle_btn.clicked.connect(lambda: self.run_js('enableCircle()'))
-        # self.poly_btn.clicked.connect(lambda: self.run_js('enablePolygon()'))
+        self.circle_btn.clicked.connect(lambda: self.run_js('enableCircle()'))
+        self.poly_btn.clicked.connect(lambda: self.run_js('enablePolygon()'))
         self.clear_btn.clicked.connect(lambda: self.run_js('clearSelection()'))
         self.folder_btn.clicked.connect(self.choose_folder)
         self.download_btn.clicked.connect(self.start_download)
@@ -168,9 +171,6 @@ class ApiWindow(QWidget):
         self.city_dropdown.clear()
         self.city_color_map = {}
 
-        with open(self.config.get_map_index_path(), 'r') as f:
-            self.city_map_data = json.load(f)
-
         os.makedirs(resolve_path("Metadata_Maps"), exist_ok=True)
         available_maps = {
             f.split("_")[0].lower()
@@ -178,10 +178,9 @@ class ApiWindow(QWidget):
             if f.endswith(".html")
         }
 
-        with open(resolve_path("cities.txt"), "r", encoding="utf-8") as f:
-            city_list = [line.strip() for line in f if line.strip()]
+        city_list = self.gazetteer.names()  # already sorted
 
-        for city in sorted(city_list):
+        for city in city_list:
             is_available = city.lower() in available_maps
             self.city_dropdown.addItem(city)
             index = self.city_dropdown.findText(city)
@@ -189,6 +188,12 @@ class ApiWindow(QWidget):
             self.city_dropdown.setItemData(index, color, Qt.TextColorRole)
             self.city_color_map[city] = is_available
 
+        # prefix matching while typing; the sorted list lets the completer binary-search it
+        completer = QCompleter(city_list, self.city_dropdown)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+        self.city_dropdown.setCompleter(completer)
+
         default_region = self.region.lower()
         default_index = self.city_dropdown.findText(default_region, Qt.MatchFixedString)
         if default_index != -1:
@@ -209,17 +214,11 @@ class ApiWindow(QWidget):
                 QMessageBox.Yes | QMessageBox.No
             )
             if reply == QMessageBox.Yes:
-                # Try fetching bounds
-                bounds = self.city_map_data.get(city)
+                # Local bounds first; Nominatim only for cities the gazetteer has no box for
+                bounds = self.gazetteer.lookup(city, fetch=self.fetch_city_bounds)
                 if not bounds:
-                    self.logger.log_status(f"Fetching bounds for {city} via Nominatim...")
-                    bounds = self.fetch_city_bounds(city)
-                    if not bounds:
-                        QMessageBox.critical(self, "Error", f"Could not fetch bounds for {city.title()}.")
-                        return
-                    self.update_map_index(city, bounds)
-                    self.populate_city_dropdown()  # Refresh dropdown color
-                    self.city_dropdown.setCurrentText(city)
+                    QMessageBox.critical(self, "Error", f"Could not fetch bounds for {city.title()}.")
+                    return
 
                 # Launch scanner
                 scanner = StreetViewDensityScanner(city=city)
@@ -233,10 +232,12 @@ class ApiWindow(QWidget):
                 scanner.workers_input.setText("10")
                 scanner.show()
                 scanner.start_btn.click()
-        self.region = city
-        self.setup_map()
+        previous, self.region = self.region, city
+        if not self.setup_map():
+            self.region = previous
 
     def fetch_city_bounds(self, city: str):
+        self.logger.log_status(f"Fetching bounds for {city} via Nominatim...")
         try:
             url = "https://nominatim.openstreetmap.org/search"
             params = {
@@ -270,35 +271,24 @@ class ApiWindow(QWidget):
             self.logger.log_exception(f"Failed to fetch bounds for {city}: {e}")
             return None
 
-    def update_map_index(self, city: str, bounds: dict):
-        try:
-            map_path = self.config.get_map_index_path()
-            if os.path.exists(map_path):
-                with open(map_path, 'r') as f:
-                    city_map_data = json.load(f)
-            else:
-                city_map_data = {}
-
-            city_map_data[city.lower()] = bounds
-            with open(map_path, 'w') as f:
-                json.dump(city_map_data, f, indent=2)
-
-            self.logger.log_status(f"Updated map_index.json with {city}: {bounds}")
-        except Exception as e:
-            self.logger.log_exception(f"Failed to update map index: {e}")
-
-    def query_results(self, db_path, north, south, east, west):
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-
-        query = """
-            SELECT c.lat, c.lon, r.pano_id
-            FROM coords c
-            JOIN results r ON c.id = r.coord_id
-            WHERE c.lat <= ? AND c.lat >= ? AND c.lon <= ? AND c.lon >= ?
+    def query_results(self, db_path, shape, coords, radius=None):
+        """
+        Unique panoramas inside a drawn shape, located at the pano itself rather than the grid point that found it.
+        Rectangles are answered straight from the R*Tree; circles and polygons use it as a
+        bounding-box prefilter before the exact distance / point-in-polygon test.
         """
-        cur.execute(query, (north, south, east, west))
-        results = cur.fetchall()
+        conn = connect_readonly(db_path)
+        if shape == 'circle':
+            lat, lng = float(coords[0][0]), float(coords[0][1])
+            results = panoramas_in_circle(conn, lat, lng, float(radius))
+        elif shape == 'polygon':
+            results = panoramas_in_polygon(conn, coords)
+        else:
+            north = float(coords[0][0])
+            south = float(coords[1][0])
+            east = float(coords[0][1])
+            west = float(coords[1][1])
+            results = panoramas_in_bbox(conn, north, south, east, west)
         conn.close()
         self.logger.log_status(results)
         return results
@@ -312,10 +302,12 @@ class ApiWindow(QWidget):
         self.channel.registerObject('coordReceiver', self.coord_receiver)
         self.view.page().setWebChannel(self.channel)
 
-        self.map_bounds = []
-        with open(self.config.get_map_index_path(), 'r') as f:
-            index = json.load(f)
-            self.map_bounds = index[self.region.lower()]
+        bounds = self.gazetteer.lookup(self.region, fetch=self.fetch_city_bounds)
+        if not bounds:
+            # no shipped bounds and the geocoder did not answer (offline?)
+            QMessageBox.critical(self, "Error", f"No bounds known for {self.region.title()}.")
+            return False
+        self.map_bounds = bounds
 
         #old = {"lat": 23.73, "lng": 92.72}
 
@@ -359,9 +351,10 @@ class ApiWindow(QWidget):
 
         google.maps.event.addListener(drawingManager, 'overlaycomplete', function(e) {{
             shapes.push(e.overlay);
-            let coords = [];
+            let coords = [], radius = null;
             if (e.type === 'circle') {{
             let center = e.overlay.getCenter(); coords.push([center.lat(), center.lng()]);
+            radius = e.overlay.getRadius();
             }} else if (e.type === 'rectangle') {{
             let bounds = e.overlay.getBounds();
             let ne = bounds.getNorthEast(), sw = bounds.getSouthWest();
@@ -371,7 +364,7 @@ class ApiWindow(QWidget):
             }}
             // send coords to Python
             new QWebChannel(qt.webChannelTransport, channel => {{
-            channel.objects.coordReceiver.receiveCoordinates(coords);
+            channel.objects.coordReceiver.receiveCoordinates({{type: e.type, coords: coords, radius: radius}});
         }});
       }});
     }}
@@ -387,6 +380,7 @@ class ApiWindow(QWidget):
 </html>"""
         self.view.setHtml(html)
         self.logger.log_status("Map initialized")
+        return True
 
     def run_js(self, script):
         try:
@@ -405,17 +399,20 @@ class ApiWindow(QWidget):
         except Exception as e:
             self.logger.log_exception(f"Folder selection failed: {e}")
 
-    def on_coordinates(self, coords):
-        # coords received from JS drawing
-        self.logger.log_status(f"Coordinates received: {coords}")
-        self.logger.log_status("Received coords:", coords)
-        north = float(coords[0][0])
-        south = float(coords[1][0])
-        east = float(coords[0][1])
-        west = float(coords[1][1])
-        data = self.query_results(self.DB_PATH, north, south, east, west)
+    def on_coordinates(self, shape):
+        # shape received from JS drawing: {type, coords, radius}
+        self.logger.log_status(f"Coordinates received: {shape}")
+        if isinstance(shape, dict):
+            kind, coords, radius = shape.get('type'), shape.get('coords'), shape.get('radius')
+        else:
+            kind, coords, radius = 'rectangle', shape, None
+        data = self.query_results(self.DB_PATH, kind, coords, radius)
+        # overlapping selections must not queue the same panorama twice
+        known = {pano_id for _, _, pano_id in self.FOUND_COORDS}
         for i in data:
-            self.FOUND_COORDS.append(i)
+            if i[2] not in known:
+                known.add(i[2])
+                self.FOUND_COORDS.append(i)
         self.logger.log_status(f"found {len(data)} results in {coords}")
         print(f'found {len(self.FOUND_COORDS)} results in selected')
         self.current_shape_coords = coords
@@ -437,11 +434,16 @@ class ApiWindow(QWidget):
             self.logger.log_status(self.FOUND_COORDS)
             self.downloader.progress.connect(self.update_progress)
             self.downloader.finished.connect(lambda: self.logger.log_status("Download thread finished"))
-            self.progress.setMaximum(len(coords))
+            total = len(self.FOUND_COORDS)
+            self.progress.setMaximum(min(total, max_images) if max_images else total)
+            self.progress.setValue(0)
             self.downloader.start()
         except Exception as e:
             self.logger.log_exception(f"Failed to start download: {e}")
 
-    def update_progress(self, current, total):
+    def update_progress(self, current, total, stages=""):
+        # the pipeline's total leaves out panoramas a previous run already saved
+        self.progress.setMaximum(total)
         self.progress.setValue(current)
-        self.logger.log_status(f"Progress: {current}/{total}")
+        self.progress.setFormat(f"%v/%m  {stages}")
+        self.logger.log_status(f"Progress: {current}/{total} {stages}")
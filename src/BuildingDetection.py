@@ -1,3 +1,5 @@
+import time
+import queue
 import tensorflow as tf
 import numpy as np
 from PIL import Image
@@ -6,8 +8,11 @@ from PyQt5.QtCore import QObject, pyqtSignal
 
 from config_ import Config
 from AppLogger import Logger
+from faces_manifest import read_faces_manifest
 
 class ObjectDetectionProcessor(QObject):
+    INPUT_POLICIES = ("fixed", "native", "max_side", "letterbox")
+
     progress_updated = pyqtSignal(float)
     log_message = pyqtSignal(str)
     image_saved = pyqtSignal(str)
@@ -37,6 +42,14 @@ class ObjectDetectionProcessor(QObject):
         self.expand_factor = self.config.get_bd_expand_factor()
         self.min_dim = self.config.get_bd_min_dim()
         self.target_classes = self.config.get_bd_target_classes()
+        self.batch_size = self.config.get_bd_batch_size()
+        self.decode_threads = self.config.get_bd_decode_threads()
+        self.prefetch = self.config.get_bd_prefetch()
+        self.input_policy = self.config.get_bd_input_policy()
+        self.input_size = self.config.get_bd_input_size()
+        if self.input_policy not in self.INPUT_POLICIES:
+            self.logger.log_status(f"Unknown input_policy {self.input_policy!r}, using 'fixed'", "WARNING")
+            self.input_policy = "fixed"
 
         self.logger.log_status(f"Loaded BUILDING_DETECTION settings:\n"
                                f"  model_path = {self.model_path}\n"
@@ -45,7 +58,8 @@ class ObjectDetectionProcessor(QObject):
                                f"  threshold = {self.threshold}\n"
                                f"  expand_factor = {self.expand_factor}\n"
                                f"  min_dim = {self.min_dim}\n"
-                               f"  target_classes = {self.target_classes}")
+                               f"  target_classes = {self.target_classes}\n"
+                               f"  input_policy = {self.input_policy} ({self.input_size})")
 
     def _load_detector(self):
         """
@@ -82,22 +96,22 @@ class ObjectDetectionProcessor(QObject):
             int(ymax_exp * img_height)
         )
 
-    def crop_and_save(self, image: np.ndarray, box, save_path: Path):
+    def crop_and_save(self, image: np.ndarray, box, save_path: Path, scale=(1.0, 1.0)):
         """
-        Crop an image (H×W×3 in [0,1]) using a normalized box + expand_factor, then save
-        only if both width and height ≥ min_dim.
+        Crop the original image (H×W×3 uint8) using a box normalized to it + expand_factor,
+        then save only if both width and height ≥ min_dim. min_dim counts detector-input
+        pixels, as it always has: scale (sy, sx) is the input/original ratio from prepare_image.
         """
         img_h, img_w, _ = image.shape
         xmin, ymin, xmax, ymax = self._expand_box(box, img_w, img_h)
         cropped = image[ymin:ymax, xmin:xmax]
 
         # Discard patches that are too small
-        if cropped.shape[0] < self.min_dim or cropped.shape[1] < self.min_dim:
+        if cropped.shape[0] * scale[0] < self.min_dim or cropped.shape[1] * scale[1] < self.min_dim:
             return
 
         try:
-            cropped_uint8 = (cropped * 255).astype(np.uint8)
-            Image.fromarray(cropped_uint8).save(save_path, format="JPEG", quality=90)
+            Image.fromarray(cropped).save(save_path, format="JPEG", quality=90)
         except Exception as e:
             self.logger.log_exception(f"Error saving image to {save_path}: {e}")
 
@@ -158,62 +172,338 @@ class ObjectDetectionProcessor(QObject):
 
         return final_detections
 
-    def _read_and_prepare_image(self, image_path: Path):
+    def prepare_image(self, image, policy=None, size=None):
+        """
+        Detector input for an RGB uint8 image [H,W,3] under an input policy, S = input_size:
+          fixed      stretch to S×S (the old behaviour; distorts the aspect ratio)
+          native     the image as it is
+          max_side   shrink so the longer side is at most S, never enlarge
+          letterbox  scale the longer side to S and pad bottom/right to S×S
+        Returns (float32 [h,w,3] in [0,1], [sy, sx]). The image content sits at the top left
+        scaled by sy, sx, which is what _to_original needs to map boxes back.
+        Works eagerly and inside tf.data. size overrides input_size.
+        """
+        policy = policy or self.input_policy
+        size = int(size or self.input_size)
+        hw = tf.cast(tf.shape(image)[:2], tf.float32)
+        if policy == "fixed":
+            new_hw = tf.fill([2], float(size))
+        elif policy == "native":
+            new_hw = hw
+        else:
+            scale = float(size) / tf.reduce_max(hw)
+            if policy == "max_side":
+                scale = tf.minimum(scale, 1.0)
+            new_hw = tf.round(hw * scale)
+
+        if policy == "native":
+            resized = tf.cast(image, tf.float32)
+        else:
+            resized = tf.image.resize(image, tf.cast(new_hw, tf.int32))
+        if policy == "letterbox":
+            resized = tf.image.pad_to_bounding_box(resized, 0, 0, size, size)
+        return resized / 255.0, new_hw / hw
+
+    @staticmethod
+    def _to_original(boxes: np.ndarray, input_hw, scale, original_hw) -> np.ndarray:
+        """
+        Boxes [N,4] normalized to the detector input → normalized to the original image.
+        Only the scaled content (top left, original size × scale) is image; padding is cut off.
+        """
+        content_hw = np.asarray(scale, dtype=np.float64) * np.asarray(original_hw, dtype=np.float64)
+        ry, rx = np.asarray(input_hw, dtype=np.float64) / content_hw
+        return np.clip(boxes * np.array([ry, rx, ry, rx]), 0.0, 1.0)
+
+    def _read_and_prepare_image(self, image_path: Path, policy=None):
         """
-        Read image → decode → resize to (3600×3600) → normalize [0,1] → add batch dim. 
-        Return a tf.Tensor of shape [1,3600,3600,3] or None on error.
+        Read image → decode → prepare_image (input_policy) → add batch dim.
+        Return (tf.Tensor [1,h,w,3], original uint8 array, scale) or None on error.
+        Cube faces are read with policy 'native'.
         """
         try:
             image_raw = tf.io.read_file(str(image_path))
-            image = tf.image.decode_image(image_raw, channels=3)
-            image_resized = tf.image.resize(image, (3600, 3600))
-            image_norm = tf.cast(image_resized, tf.float32) / 255.0
-            return tf.expand_dims(image_norm, axis=0)
+            image = tf.image.decode_image(image_raw, channels=3, expand_animations=False)
+            prepared, scale = self.prepare_image(image, policy)
+            return tf.expand_dims(prepared, axis=0), image.numpy(), scale.numpy()
         except Exception as e:
             self.logger.log_exception(f"Error reading image {image_path}: {e}")
             return None
 
-    def process(self):
+    def detect_image(self, image_tensor, original: np.ndarray, scale, base_name: str) -> int:
+        """
+        Run the detector on one prepared [1,h,w,3] tensor, dedupe/filter, and save the
+        expanded crops of the original image as {base_name}-{i}.jpg. Returns the number of crops saved.
+        """
+        return self.detect_batch(image_tensor, [original], [scale], [base_name])
+
+    def detect_boxes(self, images, originals: list[np.ndarray], scales) -> list[list[dict]] | None:
+        """
+        Detections per image of a prepared [B,h,w,3] batch, deduplicated and filtered, with
+        'box' normalized to the original image and 'box_px' = (xmin, ymin, xmax, ymax) in
+        its pixels. None if the detector failed. A batch of more than one image needs a
+        signature with an unbatched input (see _signature_batch_size).
+        """
+        results = self.detector(images)
+        raw_boxes   = results['detection_boxes'].numpy()
+        raw_scores  = results['detection_scores'].numpy().astype(np.float32)
+        raw_classes = results['detection_class_entities'].numpy()
+
+        if raw_scores.ndim == 1:
+            # single-image signatures (the openimages models) drop the batch dimension
+            raw_boxes, raw_scores, raw_classes = raw_boxes[None], raw_scores[None], raw_classes[None]
+
+        input_hw = images.shape[1:3]
+        per_image = []
+        for b, original in enumerate(originals):
+            img_h, img_w = original.shape[:2]
+            boxes = self._to_original(raw_boxes[b], input_hw, scales[b], (img_h, img_w))
+            detections = self._deduplicate_boxes(boxes, raw_scores[b], raw_classes[b])
+            for det in detections:
+                ymin, xmin, ymax, xmax = det['box']
+                det['box_px'] = (int(xmin * img_w), int(ymin * img_h), int(xmax * img_w), int(ymax * img_h))
+            per_image.append(detections)
+        return per_image
+
+    def detect_batch(self, images, originals: list[np.ndarray], scales, base_names: list[str]) -> int:
+        """
+        detect_boxes, then save the crops of each image. Returns the number of crops saved.
+        """
+        if self.detector is None:
+            return 0
+        try:
+            per_image = self.detect_boxes(images, originals, scales)
+        except Exception as e:
+            self.logger.log_exception(f"Detection failed on {', '.join(base_names)}: {e}")
+            return 0
+
+        saved = 0
+        for original, scale, detections, base_name in zip(originals, scales, per_image, base_names):
+            saved += self._save_detections(original, detections, base_name, scale)
+        return saved
+
+    def _save_detections(self, original_image: np.ndarray, detections: list[dict], base_name: str,
+                         scale=(1.0, 1.0)) -> int:
+        for i, det in enumerate(detections, start=1):
+            save_path = self.output_dir / f"{base_name}-{i}.jpg"
+            self.crop_and_save(original_image, det['box'], save_path, scale)
+            self.log_message.emit(f"Saved cropped image to {save_path}")
+            self.image_saved.emit(str(save_path))
+        return len(detections)
+
+    def _signature_batch_size(self) -> int:
+        """
+        How many images one detector call may take: batch_size if the signature's input
+        has an open batch dimension, else 1 (faster_rcnn/openimages_v4 is fixed at [1,H,W,3]).
+        """
+        if self.detector is None or self.batch_size <= 1:
+            return 1
+        try:
+            specs = self.detector.structured_input_signature[1]
+            spec = next(iter(specs.values()))
+            return self.batch_size if spec.shape.rank and spec.shape[0] is None else 1
+        except Exception:
+            return 1
+
+    def _dataset(self, image_files: list[Path], policy=None, batch_size=1):
+        """
+        tf.data pipeline over image_files yielding ([B,h,w,3] float32 inputs, [B,2] scales,
+        [B,H,W,3] originals, [B,2] original sizes, [B] paths): files are read, decoded and
+        prepared on decode_threads threads and prefetched while the detector runs. Images
+        that fail to decode are skipped. Originals are zero-padded to the largest in the
+        batch; cut them back with their sizes. Inputs are only padded if batch_size > 1 is
+        used with a policy that gives them different shapes, which process() avoids.
+        """
+        def load(path):
+            image = tf.image.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+            prepared, scale = self.prepare_image(image, policy)
+            return prepared, scale, image, tf.shape(image)[:2], path
+
+        dataset = tf.data.Dataset.from_tensor_slices([str(p) for p in image_files])
+        dataset = dataset.map(load, num_parallel_calls=max(1, self.decode_threads), deterministic=True)
+        dataset = dataset.apply(tf.data.experimental.ignore_errors())
+        dataset = dataset.padded_batch(batch_size)
+        # bounded: a 3600×3600 float32 input is ~155 MB
+        return dataset.prefetch(max(1, self.prefetch))
+
+    def detect_array(self, image: np.ndarray, base_name: str, resize=True) -> int:
+        """
+        detect_image for an RGB uint8 array already in memory, prepared the same way
+        _read_and_prepare_image prepares a file (resize=False: native size).
         """
-        Main entrypoint: iterate over all .jpg/.jpeg/.png files in input_dir,
-        run detector, dedupe/filter, crop + save, emit progress/log, then finish.
+        prepared, scale = self.prepare_image(image, None if resize else "native")
+        return self.detect_image(tf.expand_dims(prepared, axis=0), image, scale.numpy(), base_name)
+
+    def process_queue(self, images: queue.Queue, total: int, stop=None):
+        """
+        Fused crop→detect entrypoint: consume (base_name, rgb_array, resize) items put by
+        the crop stage until the stop sentinel, emitting progress against total. total is
+        the crop stage's estimate; progress reaches 100 at the sentinel, when every part
+        that was actually queued is done.
+        """
+        done = 0
+        while True:
+            item = images.get()
+            if item is stop:
+                break
+            base_name, image, resize = item
+            done += 1
+            self.log_message.emit(f"Processing image {base_name} ({done}/{total})")
+            try:
+                self.detect_array(image, base_name, resize)
+            except Exception as e:  # keep consuming, or the crop stage would block on a full queue
+                self.logger.log_exception(f"Detection failed on {base_name}: {e}")
+            self.progress_updated.emit(100.0 * done / total if total else 0.0)
+
+        self.progress_updated.emit(100.0)
+        self.log_message.emit("All image processing complete.")
+        self.finished.emit()
+
+    def _image_files(self) -> tuple[list[Path], bool]:
+        """
+        Files to detect on and whether input_policy applies to them: the manifest's cube
+        faces (native size) or every .jpg/.jpeg/.png in input_dir.
         """
+        faces = read_faces_manifest(self.input_dir)
+        if faces is not None:
+            # cube faces are detected at their native size instead of being stretched to 3600×3600
+            return [Path(entry["path"]) for entry in faces], False
         image_files = (
             list(self.input_dir.glob("*.jpg")) +
             list(self.input_dir.glob("*.jpeg")) +
             list(self.input_dir.glob("*.png"))
         )
+        return image_files, True
 
+    def process(self):
+        """
+        Main entrypoint: stream all .jpg/.jpeg/.png files in input_dir through the tf.data
+        pipeline, run detector, dedupe/filter, crop + save, emit progress/log, then finish.
+        """
+        image_files, resize = self._image_files()
         total_files = len(image_files)
         self.log_message.emit(f"Total files = {total_files}")
-        for idx, image_file in enumerate(image_files, start=1):
-            progress = float(idx) / total_files if total_files else 0.0
-            self.progress_updated.emit(progress * 100)  # emit 0–100
-            self.log_message.emit(f"Processing image {image_file.name} ({idx}/{total_files})")
-
-            image_tensor = self._read_and_prepare_image(image_file)
-            if image_tensor is None or self.detector is None:
-                continue
-
-            try:
-                results = self.detector(image_tensor)
-                raw_boxes   = results['detection_boxes'].numpy()
-                raw_scores  = results['detection_scores'].numpy().astype(np.float32)
-                raw_classes = results['detection_class_entities'].numpy()
-                original_image = tf.squeeze(image_tensor).numpy()  # [3600×3600×3]
-            except Exception as e:
-                self.logger.log_exception(f"Detection failed on {image_file.name}: {e}")
-                continue
-
-            detections = self._deduplicate_boxes(raw_boxes, raw_scores, raw_classes)
-            base_name = image_file.stem
-
-            for i, det in enumerate(detections, start=1):
-                save_path = self.output_dir / f"{base_name}-{i}.jpg"
-                self.crop_and_save(original_image, det['box'], save_path)
-                self.log_message.emit(f"Saved cropped image to {save_path}")
-                self.image_saved.emit(str(save_path))
-
+        policy = self.input_policy if resize else "native"
+        # only fixed and letterbox give every input the same shape
+        batch_size = self._signature_batch_size() if policy in ("fixed", "letterbox") else 1
+        start = time.perf_counter()
+
+        done = 0
+        if self.detector is not None and total_files:
+            for images, scales, originals, sizes, paths in self._dataset(image_files, policy, batch_size):
+                names = [Path(p.decode("utf-8")).stem for p in paths.numpy()]
+                originals = [image[:h, :w] for image, (h, w) in zip(originals.numpy(), sizes.numpy())]
+                done += len(names)
+                self.log_message.emit(f"Processing image {', '.join(names)} ({done}/{total_files})")
+                self.detect_batch(images, originals, scales.numpy(), names)
+                self.progress_updated.emit(100.0 * done / total_files)  # emit 0–100
+
+        elapsed = time.perf_counter() - start
+        self.log_message.emit(f"Detected on {done} images in {elapsed:.1f} s "
+                              f"({done / elapsed if elapsed else 0:.2f} images/s, batch {batch_size})")
         self.log_message.emit("All image processing complete.")
         self.finished.emit()
 
+    def process_serial(self):
+        """
+        The previous loop: read, decode, resize and detect one image at a time with no
+        overlap. Kept for benchmark_detection.
+        """
+        image_files, resize = self._image_files()
+        for image_file in image_files:
+            prepared = self._read_and_prepare_image(image_file, None if resize else "native")
+            if prepared is None or self.detector is None:
+                continue
+            self.detect_image(*prepared, image_file.stem)
+
+
+def benchmark_detection(config: Config, logger: Logger, limit: int = 8):
+    """
+    images/s of process_serial against the tf.data process() on the first `limit` files of
+    the configured input folder, on CPU. Crops go to a temporary folder.
+    """
+    import tempfile
+    tf.config.set_visible_devices([], "GPU")
+    processor = ObjectDetectionProcessor(config, logger)
+    image_files, resize = processor._image_files()
+    image_files = image_files[:limit]
+    if not image_files:
+        logger.log_status(f"No images in {processor.input_dir} to benchmark detection on", "WARNING")
+        return {}
+    processor._image_files = lambda: (image_files, resize)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        processor.output_dir = Path(tmp)
+        # traces the graph for the shapes the timed runs use (faces: native size)
+        warmup = processor._read_and_prepare_image(image_files[0], None if resize else "native")
+        if warmup is not None:
+            processor.detect_image(*warmup, "warmup")
+        for name, run in (("serial", processor.process_serial), ("tf.data", processor.process)):
+            start = time.perf_counter()
+            run()
+            results[name] = len(image_files) / (time.perf_counter() - start)
+            logger.log_status(f"detection {name}: {results[name]:.3f} images/s")
+            print(f"{name:<8} {results[name]:.3f} images/s over {len(image_files)} images")
+    return results
+
+
+def _box_iou(a, b) -> float:
+    # (xmin, ymin, xmax, ymax) pixel boxes
+    iw = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def benchmark_input_policies(config: Config, logger: Logger, limit: int = 8, settings=None, iou=0.5):
+    """
+    Recall, ms/image and input tensor size of each (input_policy, input_size) setting on the
+    first `limit` files of the configured input folder, on CPU. Recall is measured against
+    the detections of the old fixed 3600×3600 input: a reference box counts as found when a
+    box of the same class overlaps it by IoU ≥ iou in original pixels. Nothing is saved.
+    """
+    tf.config.set_visible_devices([], "GPU")
+    settings = settings or [("fixed", 3600), ("native", 0), ("max_side", 2048), ("max_side", 1024),
+                            ("letterbox", 2048), ("letterbox", 1024)]
+    processor = ObjectDetectionProcessor(config, logger)
+    image_files = processor._image_files()[0][:limit]
+    if not image_files:
+        logger.log_status(f"No images in {processor.input_dir} to benchmark input policies on", "WARNING")
+        return {}
+    originals = [tf.image.decode_image(tf.io.read_file(str(p)), channels=3, expand_animations=False)
+                 for p in image_files]
+
+    def run(policy, size):
+        prepared = processor.prepare_image(originals[0], policy, size)
+        processor.detect_boxes(tf.expand_dims(prepared[0], 0), [originals[0].numpy()], [prepared[1].numpy()])  # traces
+        detections, seconds, megabytes = [], 0.0, 0.0
+        for image in originals:
+            start = time.perf_counter()
+            prepared, scale = processor.prepare_image(image, policy, size)
+            detections.append(processor.detect_boxes(tf.expand_dims(prepared, 0), [image.numpy()], [scale.numpy()])[0])
+            seconds += time.perf_counter() - start
+            megabytes += prepared.shape[0] * prepared.shape[1] * 3 * 4 / 2**20
+        return detections, seconds / len(originals) * 1000, megabytes / len(originals)
+
+    reference = run("fixed", 3600)[0]
+    total = sum(len(d) for d in reference)
+    results = {}
+    for policy, size in settings:
+        detections, ms, mb = run(policy, size)
+        found = sum(1 for ref, got in zip(reference, detections) for r in ref
+                    if any(g['class'] == r['class'] and _box_iou(g['box_px'], r['box_px']) >= iou for g in got))
+        recall = found / total if total else 1.0
+        results[(policy, size)] = {"recall": recall, "ms": ms, "input_mb": mb,
+                                   "detections": sum(len(d) for d in detections)}
+        label = f"{policy} {size}" if policy != "native" else policy
+        line = f"{label:<15} recall {recall:6.1%}  {ms:8.1f} ms/image  {mb:7.1f} MB input"
+        logger.log_status(f"input policy {line}")
+        print(line)
+    return results
+
+
+if __name__ == "__main__":
+    _logger = Logger(__name__)
+    _config = Config(_logger)
+    benchmark_detection(_config, _logger)
+    benchmark_input_policies(_config, _logger)
@@ -1,5 +1,7 @@
 import os
 import json
+import queue
+import threading
 import cv2
 import numpy as np
 from pathlib import Path
@@ -8,7 +10,9 @@ from PyQt5.QtGui import QPixmap, QImage, QPen, QPainter
 from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot, QPointF, Qt
 from config_ import Config
 from AppLogger import Logger
-from utils import ensure_directory_exists, save_image, resolve_path
+from utils import ensure_directory_exists, resolve_path
+from faces_manifest import read_faces_manifest, FacesManifestWriter
+from crop_engine import crop_file, run_crop_jobs, crop_arrays, crop_names, save_crop_arrays
 
 
 ### Show what types of photo types are allowed in the file browse dialog
@@ -36,48 +40,46 @@ class ImageProcessorWorker(QObject):
         self.supported_files = tuple(
             item.strip() for item in self.config.get_allowed_file_types().split(',')
         )
-
-    def _parts_of_img(self, img, dimensions: tuple[int, int] = (100, 100)) -> list:
-        x, y = dimensions
-        return [img[0:y, 0:x//2], img[0:y, x//2:x]] if x > 0 and y > 0 else []
-
-    def _save_image_with_coords(self, image, save_folder: Path, name, coordinates=(0, 0)):
-        save_path = save_folder/f'{name}_{coordinates}.jpg'
-        return save_image(image, save_path, logger=self.logger), save_path
+        # cube faces listed in the input folder's faces_manifest.jsonl, by path
+        self.face_entries = {}
 
     def _get_all_addresses(self) -> list:
         directory = self.config.get_current_input_folder_process()
         if not directory.exists():
             return []
+        faces = read_faces_manifest(directory)
+        if faces is not None:
+            # downloaded in 'faces' mode: only the listed faces, used whole
+            self.face_entries = {Path(entry["path"]): entry for entry in faces}
+            return list(self.face_entries)
         files = []
         for ext in self.supported_files:
             files.extend(directory.glob(f"*{ext}"))
         return files
 
-    def _process_file(self, image_path: Path) -> dict:
+    def _crop_settings(self):
         size_img = self.config.get_image_size()
         if isinstance(size_img, str):
             size_img = tuple(int(i) for i in size_img.split(','))
-        blur_region = self.config.get_blur_size()
-
-        image = cv2.imread(str(image_path))
-        if image is None:
-            return {"source_file": str(image_path), "saved_files": [], "success": False}
+        return size_img, self.config.get_blur_size()
 
-        images = self._parts_of_img(image, (size_img[0], size_img[1] - blur_region))
+    def _process_file(self, image_path: Path) -> dict:
+        """
+        Crop one file in this process: the processed_metadata.json entry run() records for it.
+        run() does the same through run_crop_jobs, chunked over a process pool.
+        """
+        size_img, blur_region = self._crop_settings()
+        # a single 90° view is already the region of interest; no halving or car crop
+        return crop_file(image_path, self.save_folder, size_img, blur_region, whole=image_path in self.face_entries,
+                         method=self.config.get("Processed", "crop_method", fallback="auto"))
 
-        saved_files = []
-        for x, img in enumerate(images):
-            if img is not None:
-                success, path = self._save_image_with_coords(img, self.save_folder, name=image_path.stem, coordinates=(0, x))
-                if success:
-                    saved_files.append(str(path))
+    def _keep_going(self) -> bool:
+        while self.is_paused and not self.is_cancelled:
+            QThread.msleep(100)
+        return not self.is_cancelled
 
-        return {
-            "source_file": str(image_path),
-            "saved_files": saved_files,
-            "success": bool(saved_files)
-        }
+    def _config_flag(self, option, fallback="False") -> bool:
+        return str(self.config.get("Processed", option, fallback=fallback)).strip().lower() in ("1", "true", "yes")
 
     @pyqtSlot()
     def run(self):
@@ -86,37 +88,115 @@ class ImageProcessorWorker(QObject):
             self.error_occurred.emit("No valid image files found.")
             return
 
-        all_metadata = []
+        if self._config_flag("fused_detection"):
+            self._run_fused(image_paths)
+            return
+
+        all_metadata = [None] * len(image_paths)
         success_count = 0
 
         metadata_file = self.save_folder/"processed_metadata.json"
-
-        for index, path in enumerate(image_paths):
-            while self.is_paused:
-                QThread.msleep(100)
-
-            if self.is_cancelled:
-                self.logger.log_status("Processing cancelled by user.")
-                break
-
-            result = self._process_file(path)
-            all_metadata.append(result)
+        faces_manifest = FacesManifestWriter(self.save_folder) if self.face_entries else None
+
+        # decode/slice/encode is CPU bound: fan chunks of files out over a process pool
+        size_img, blur_region = self._crop_settings()
+        workers = int(self.config.get("Processed", "crop_processes", fallback=str(os.cpu_count() or 1)))
+        chunk_size = int(self.config.get("Processed", "crop_chunk_size", fallback="8"))
+        method = self.config.get("Processed", "crop_method", fallback="auto")
+        # face_paths: a single 90° view is already the region of interest; no halving or car crop
+        jobs = run_crop_jobs(image_paths, self.save_folder, size_img, blur_region, face_paths=self.face_entries,
+                             workers=workers, chunk_size=chunk_size, keep_going=self._keep_going, method=method)
+
+        for finished, (index, result) in enumerate(jobs):
+            path = image_paths[index]
+            all_metadata[index] = result
+            if faces_manifest and result["success"]:
+                # pass the face metadata on, so detection also treats the outputs as faces
+                entry = {k: v for k, v in self.face_entries[path].items() if k != "path"}
+                for saved in result["saved_files"]:
+                    faces_manifest.add({**entry, "file": Path(saved).name})
 
             if result["success"]:
                 success_count += 1
+                self.logger.log_status(f"Saved {len(result['saved_files'])} crops of {path}")
                 self.file_processed.emit(str(path))
 
-            progress = int(((index + 1) / len(image_paths)) * 100)
+            progress = int(((finished + 1) / len(image_paths)) * 100)
             self.progress_updated.emit(progress)
 
-        if not self.is_cancelled:
+        if self.is_cancelled:
+            self.logger.log_status("Processing cancelled by user.")
+        else:
             with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(all_metadata, f, indent=4)
+                json.dump([m for m in all_metadata if m is not None], f, indent=4)
 
             self.config.set_input_folder_detection(str(self.save_folder))
             self.processing_complete.emit(success_count)
 
 
+    def _run_fused(self, image_paths):
+        """
+        Crop → detect without intermediate files: each image's parts go to the building
+        detector as RGB arrays through a bounded queue, so cropping stays at most
+        fused_queue_size parts ahead of detection. Crops are only written (for audit)
+        when save_crops is set. Detection dominates the run time, so parts are produced
+        on this thread rather than the crop process pool.
+        """
+        from BuildingDetection import ObjectDetectionProcessor  # TensorFlow is only needed in this mode
+        processor = ObjectDetectionProcessor(self.config, self.logger)
+        processor.log_message.connect(self.logger.log_status)
+        processor.progress_updated.connect(lambda pct: self.progress_updated.emit(int(pct)))
+
+        size_img, blur_region = self._crop_settings()
+        save_crops = self._config_flag("save_crops")
+        images = queue.Queue(maxsize=int(self.config.get("Processed", "fused_queue_size", fallback="4")))
+        stop = object()
+        total = sum(1 if path in self.face_entries else 2 for path in image_paths)
+        detector = threading.Thread(target=processor.process_queue, args=(images, total, stop), daemon=True)
+        detector.start()
+
+        all_metadata = []
+        success_count = 0
+        faces_manifest = FacesManifestWriter(self.save_folder) if self.face_entries and save_crops else None
+
+        try:
+            for path in image_paths:
+                if not self._keep_going():
+                    self.logger.log_status("Processing cancelled by user.")
+                    break
+
+                whole = path in self.face_entries
+                try:
+                    parts = crop_arrays(path, size_img, blur_region, whole)
+                    saved_files = save_crop_arrays(parts, path, self.save_folder) if save_crops else []
+                except Exception as e:
+                    # one bad file is a failed entry, as on the crop_engine path
+                    self.logger.log_exception(f"Failed to crop {path}: {e}")
+                    all_metadata.append({"source_file": str(path), "saved_files": [], "success": False, "error": str(e)})
+                    continue
+                for name, part in zip(crop_names(path, len(parts)), parts):
+                    images.put((name, part, not whole))  # faces are detected at native size
+
+                all_metadata.append({"source_file": str(path), "saved_files": saved_files, "success": bool(parts)})
+                if faces_manifest:
+                    entry = {k: v for k, v in self.face_entries[path].items() if k != "path"}
+                    for saved in saved_files:
+                        faces_manifest.add({**entry, "file": Path(saved).name})
+                if parts:
+                    success_count += 1
+                    self.file_processed.emit(str(path))
+        finally:
+            images.put(stop)
+            detector.join()
+
+        if not self.is_cancelled:
+            with open(self.save_folder/"processed_metadata.json", 'w', encoding='utf-8') as f:
+                json.dump(all_metadata, f, indent=4)
+            if save_crops:
+                self.config.set_input_folder_detection(str(self.save_folder))
+            self.processing_complete.emit(success_count)
+
+
 class ImageCropperView(QGraphicsView):
     def __init__(self,config:Config,  logger: Logger, parent=None):
         super().__init__(parent)
@@ -263,6 +343,12 @@ class CropWindow(QWidget):
         controls_layout.addWidget(self.height_check_btn)
         controls_layout.addWidget(self.save_crop_button)
 
+        self.fused_checkbox = QCheckBox("Detect buildings directly (no intermediate crops)")
+        self.fused_checkbox.setChecked(str(self.config.get("Processed", "fused_detection", fallback="False")).lower() == "true")
+        self.fused_checkbox.stateChanged.connect(
+            lambda state: self.config.set("Processed", "fused_detection", str(state == Qt.Checked)))
+        controls_layout.addWidget(self.fused_checkbox)
+
         self.layout.addLayout(controls_layout)
 
         # Load first image
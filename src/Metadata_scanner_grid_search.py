@@ -2,13 +2,17 @@ import sys
 import os
 import sqlite3
 import time
+import queue
+import asyncio
 import threading
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 from tenacity import retry, wait_exponential, stop_after_attempt
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton,
-    QProgressBar, QHBoxLayout, QMessageBox, QFileDialog
+    QProgressBar, QHBoxLayout, QMessageBox, QFileDialog, QComboBox
 )
 from PyQt5.QtCore import QUrl, QTimer, pyqtSignal, QThread
 from PyQt5.QtWebEngineWidgets import QWebEngineView
@@ -20,33 +24,224 @@ logger = Logger(__name__)
 from config_ import Config
 config = Config(logger=logger)
 
+from rate_limiter import get_rate_limiter, RateLimitedError
+from metadata_db import connect as connect_metadata_db, scan_efficiency
+from road_candidates import road_candidates
+
 # Settings
 COARSE_SPACING = float(config.get_download_data()["coarse_spacing"])  # ~300m
 FINE_SPACING = float(config.get_download_data()["fine_spacing"])  # ~100m
-RATE_LIMIT_PER_MIN = 30000
+MIN_SPACING = float(config.get("Download", "min_spacing", fallback=FINE_SPACING / 2))  # smallest quadtree cell, ~50m
+SCAN_STRATEGY = config.get("Download", "scan_strategy", fallback="grid")
+ROAD_EXTRACT_PATH = config.get("Download", "road_extract_path", fallback="")
+ROAD_SPACING_M = float(config.get("Download", "road_spacing_m", fallback="20"))
+RATE_LIMIT_PER_MIN = config.get_rate_limit_per_min()
+# extra passes over coords still unscanned when the feed runs dry (failed requests or writes)
+RETRY_PASSES = int(config.get("Download", "scan_retry_passes", fallback="1"))
+METADATA_URL = "https://maps.googleapis.com/maps/api/streetview/metadata"
 SAVE_DB_DEFAULT = config.get_paths_data()["metadata_database_path"]
-
-class RateLimiter:
-    def __init__(self, max_calls_per_minute):
-        self.max_calls = max_calls_per_minute
-        self.period = 60.0
-        self.allowance = max_calls_per_minute
-        self.last_check = time.time()
+# Distinct points are at least half the smallest spacing apart (quadtree children sit half a cell
+# off their parent), so a quarter of it keeps them in separate cells while float-drifted copies still match
+LATTICE_QUANTUM = min(FINE_SPACING, MIN_SPACING) / 4
+
+def lattice_key(lat, lon, quantum=LATTICE_QUANTUM):
+    """
+    Integer-snapped lattice cell of a grid point, packed into a single int for cheap set lookups.
+    """
+    return (round(lat / quantum) << 32) | (round(lon / quantum) & 0xFFFFFFFF)
+
+def fine_rings_collide(coarse=COARSE_SPACING, fine=FINE_SPACING, quantum=LATTICE_QUANTUM):
+    """
+    Whether the fine ring of one coarse hit can land on a lattice point another coarse point
+    or its ring already holds. Ring points sit at -fine, 0, +fine around each coarse point, so
+    that only happens when coarse is fine or 2 * fine. At the shipped 0.003 / 0.001 the rings
+    tile exactly and the grid strategy never requests a point twice; quadtree children never
+    collide either (each sits at the centre of its own sub-cell).
+    """
+    return any(abs(coarse - k * fine) < quantum for k in (1, 2))
+
+class ScanResultWriter(threading.Thread):
+    """
+    Single writer for the scan database.
+    Worker threads push (coord_id, status, pano_id, location, children) records with put();
+    this thread drains the queue on one WAL-mode connection, writes them with
+    executemany and commits every batch_size records or commit_interval seconds.
+    Children whose lattice cell is already in coords (queued or scanned) are dropped
+    before insert; the writer is the only inserter, so its key set is authoritative.
+    With dedupe=False (see fine_rings_collide) no key set is kept and children go straight in.
+    """
+    _STOP = object()
+
+    def __init__(self, db_path, batch_size=500, commit_interval=1.0, dedupe=True):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.dedupe = dedupe
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.queue = queue.Queue()
         self.lock = threading.Lock()
-
-    def acquire(self):
+        self.received = 0
+        self.committed = 0
+        self.skipped = 0
+        self.seen = set()
+        self.started_at = time.time()
+
+    def put(self, coord_id, status, pano_id=None, location=None, children=()):
+        """
+        Queue the outcome of one metadata request. location is the panorama's own
+        (lat, lng) and children is a list of (lat, lon, stage, depth) rows to insert into coords.
+        """
         with self.lock:
-            current = time.time()
-            elapsed = current - self.last_check
-            self.last_check = current
-            self.allowance += elapsed * (self.max_calls / self.period)
-            if self.allowance > self.max_calls:
-                self.allowance = self.max_calls
-            if self.allowance < 1.0:
-                return False 
-            else:
-                self.allowance -= 1
-                return True
+            self.received += 1
+        self.queue.put((coord_id, status, pano_id, location, list(children)))
+
+    def flush(self):
+        """
+        Block until every record queued so far has been committed.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """
+        Commit whatever is left in the queue and end the thread.
+        """
+        self.queue.put(self._STOP)
+        self.join()
+
+    def stats(self):
+        """
+        Returns requests/s handed to the writer, rows/s committed, the current backlog
+        and how many duplicate children (metadata requests) were skipped.
+        """
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        with self.lock:
+            received, committed, skipped = self.received, self.committed, self.skipped
+        return {
+            "requests_per_s": received / elapsed,
+            "rows_committed_per_s": committed / elapsed,
+            "backlog": received - committed,
+            "saved_requests": skipped,
+        }
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if self.dedupe:
+            for lat, lon in conn.execute("SELECT lat, lon FROM coords"):
+                self.seen.add(lattice_key(lat, lon))
+        self.started_at = time.time()
+        pending = []
+        last_commit = time.time()
+        stopping = False
+
+        while not stopping:
+            timeout = max(0.0, self.commit_interval - (time.time() - last_commit))
+            try:
+                item = self.queue.get(timeout=timeout)
+                if item is self._STOP:
+                    stopping = True
+                    self.queue.task_done()
+                else:
+                    pending.append(item)
+            except queue.Empty:
+                pass
+
+            due = len(pending) >= self.batch_size or time.time() - last_commit >= self.commit_interval
+            if pending and (due or stopping):
+                self._write_batch(conn, pending)
+                for _ in pending:
+                    self.queue.task_done()
+                pending = []
+            if due or stopping:
+                last_commit = time.time()
+
+        conn.close()
+
+    def _write_batch(self, conn, records):
+        scanned, results, panoramas, children, responses = [], [], [], [], []
+        new_keys = set()
+        skipped = 0
+        for coord_id, status, pano_id, location, kids in records:
+            scanned.append((coord_id,))
+            responses.append((coord_id, status))
+            if status == "OK":
+                results.append((coord_id, pano_id))
+                pano_lat, pano_lng = location or (None, None)
+                panoramas.append((pano_id, pano_lat, pano_lng, coord_id))
+            if not self.dedupe:
+                children.extend(kids)
+                continue
+            for lat, lon, stage, depth in kids:
+                key = lattice_key(lat, lon)
+                if key in self.seen or key in new_keys:
+                    skipped += 1
+                    continue
+                new_keys.add(key)
+                children.append((lat, lon, stage, depth))
+
+        try:
+            cur = conn.cursor()
+            cur.executemany("UPDATE coords SET scanned=1 WHERE id=?", scanned)
+            cur.executemany("INSERT INTO results(coord_id,pano_id) VALUES(?,?)", results)
+            # first finder wins; later hits of the same pano only add a results row
+            cur.executemany("INSERT OR IGNORE INTO panoramas(pano_id,lat,lng,coord_id) VALUES(?,?,?,?)", panoramas)
+            cur.executemany("INSERT INTO coords(lat,lon,stage,depth) VALUES(?,?,?,?)", children)
+            cur.executemany("INSERT INTO responses(coord_id,response) VALUES(?,?)", responses)
+            conn.commit()
+            self.seen |= new_keys
+            with self.lock:
+                self.committed += len(records)
+                self.skipped += skipped
+        except sqlite3.Error as e:
+            # Rows stay scanned=0: the scan loop's retry pass (CoordFeed.rewind) or a resumed scan asks again
+            conn.rollback()
+            logger.log_exception(f"Failed to write {len(records)} scan records: {e}")
+
+class CoordFeed:
+    """
+    Prefetching keyset cursors over coords WHERE scanned=0.
+    Refinement children (depth > 0) and seed points (depth 0) are read through
+    separate cursors (id > last id seen) and pop() hands out children first. Rows
+    inserted later always get larger ids, so new children are seen on the next refill().
+    The cursors only move forward; rewind() starts them over, so rows whose request or
+    write failed are handed out again.
+    """
+    STAGE_FILTERS = ("depth>0", "depth=0")
+
+    def __init__(self, db_path, prefetch):
+        self.conn = sqlite3.connect(db_path)
+        self.prefetch = prefetch
+        self.pending = {key: deque() for key in self.STAGE_FILTERS}
+        self.cursors = {key: 0 for key in self.STAGE_FILTERS}
+
+    def refill(self):
+        for key, rows in self.pending.items():
+            if len(rows) < self.prefetch:
+                cur = self.conn.execute(
+                    f"SELECT id,lat,lon,stage,depth FROM coords WHERE scanned=0 AND {key} AND id>? ORDER BY id LIMIT ?",
+                    (self.cursors[key], self.prefetch * 2)
+                )
+                batch = cur.fetchall()
+                if batch:
+                    self.cursors[key] = batch[-1][0]
+                    rows.extend(batch)
+
+    def rewind(self):
+        for key in self.cursors:
+            self.cursors[key] = 0
+
+    def pop(self):
+        for rows in self.pending.values():
+            if rows:
+                return rows.popleft()
+        return None
+
+    def empty(self):
+        return not any(self.pending.values())
+
+    def close(self):
+        self.conn.close()
 
 class StreetViewDensityScanner(QWidget):
     update_ui_signal = pyqtSignal(bool)
@@ -82,11 +277,34 @@ class StreetViewDensityScanner(QWidget):
         self.workers_input.setPlaceholderText("Max Threads (e.g. 10)")
         layout.addWidget(self.workers_input)
 
+        engine_row = QHBoxLayout()
+        engine_row.addWidget(QLabel("Engine"))
+        self.engine_input = QComboBox()
+        self.engine_input.addItems(["threads", "async"])
+        engine_row.addWidget(self.engine_input)
+        engine_row.addWidget(QLabel("Strategy"))
+        self.strategy_input = QComboBox()
+        self.strategy_input.addItems(["grid", "quadtree", "roads"])
+        self.strategy_input.setCurrentText(SCAN_STRATEGY)
+        engine_row.addWidget(self.strategy_input)
+        layout.addLayout(engine_row)
+
         self.dbfile_input = QLineEdit()
         self.dbfile_input.setPlaceholderText(SAVE_DB_DEFAULT)
         browse_btn = QPushButton("Browse DB File...")
         browse_btn.clicked.connect(self.browse_db)
 
+        self.roads_input = QLineEdit()
+        self.roads_input.setPlaceholderText("OSM road extract (.geojson / .osm.pbf) for the roads strategy")
+        self.roads_input.setText(ROAD_EXTRACT_PATH)
+        roads_btn = QPushButton("Browse Roads...")
+        roads_btn.clicked.connect(self.browse_roads)
+
+        roadsrow = QHBoxLayout()
+        roadsrow.addWidget(self.roads_input)
+        roadsrow.addWidget(roads_btn)
+        layout.addLayout(roadsrow)
+
         dbrow = QHBoxLayout()
         dbrow.addWidget(self.dbfile_input)
         dbrow.addWidget(browse_btn)
@@ -117,33 +335,22 @@ class StreetViewDensityScanner(QWidget):
         if fname: 
             self.dbfile_input.setText(fname)
 
+    def browse_roads(self):
+        fname, _ = QFileDialog.getOpenFileName(self, "Select road extract", "", "OSM roads (*.geojson *.json *.pbf);;All Files(*)")
+        if fname:
+            self.roads_input.setText(fname)
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS coords (
-                id INTEGER PRIMARY KEY,
-                lat REAL, lon REAL,
-                stage TEXT, scanned INTEGER DEFAULT 0
-            )""")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS results (
-                coord_id INTEGER, pano_id TEXT,
-                FOREIGN KEY(coord_id) REFERENCES coords(id)
-            )""")
-
-
-        #### Temporary table that stores the http responses recieved when querying for metadata. Making ths as I was getting 
-        #### no "OK" responses
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS responses (
-                coord_id INTEGER, response TEXT
-            )""")
-        
-        conn.commit()
+        conn = connect_metadata_db(self.db_path)
         conn.close()
 
-    def populate_coarse(self, north, south, east, west):
+    def populate_coarse(self, north, south, east, west, stage='coarse'):
+        """
+        Seed an empty DB with the depth-0 lattice at COARSE_SPACING, starting at the north-west
+        corner. stage is 'coarse' for the two-level grid and 'quad' for the quadtree, whose root
+        cells are the COARSE_SPACING squares centred on these points (so cells on the edge
+        reach half a cell outside the bounds).
+        """
         conn = sqlite3.connect(self.db_path)
         cur = conn.cursor()
         cur.execute("SELECT COUNT(*) FROM coords")
@@ -152,12 +359,41 @@ class StreetViewDensityScanner(QWidget):
             while lat >= south:
                 lon = west
                 while lon <= east:
-                    batch.append((lat, lon, 'coarse'))
+                    batch.append((lat, lon, stage))
                     lon += COARSE_SPACING
                 lat -= COARSE_SPACING
-            cur.executemany("INSERT INTO coords(lat, lon, stage) VALUES(?, ?, ?)", batch)
+            cur.executemany("INSERT INTO coords(lat, lon, stage, depth) VALUES(?, ?, ?, 0)", batch)
             conn.commit()
+        else:
+            cur.execute("SELECT DISTINCT stage FROM coords WHERE depth=0")
+            existing = [row[0] for row in cur.fetchall()]
+            if stage not in existing:
+                logger.log_status(f"{self.db_path} was seeded with {existing}; resuming that scan instead of {stage}", "WARNING")
+        conn.close()
+
+    def populate_roads(self, path, north, south, east, west):
+        """
+        Add sample points along the roads of a local OSM extract as stage 'road' seeds.
+        Runs once per DB; points whose lattice cell is already in coords are skipped.
+        """
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS(SELECT 1 FROM coords WHERE stage='road')")
+        if cur.fetchone()[0]:
+            conn.close()
+            return
+
+        seen = {lattice_key(lat, lon) for lat, lon in cur.execute("SELECT lat, lon FROM coords")}
+        batch = []
+        for lat, lon in road_candidates(path, north, south, east, west, ROAD_SPACING_M):
+            key = lattice_key(lat, lon)
+            if key not in seen:
+                seen.add(key)
+                batch.append((lat, lon, 'road'))
+        cur.executemany("INSERT INTO coords(lat, lon, stage, depth) VALUES(?, ?, ?, 0)", batch)
+        conn.commit()
         conn.close()
+        logger.log_status(f"Added {len(batch)} road candidates every {ROAD_SPACING_M} m from {path}")
 
     def start_scan(self):
         if self.scanning:
@@ -171,13 +407,36 @@ class StreetViewDensityScanner(QWidget):
             west = float(self.edge_inputs["West (min lon)"].text())
             self.max_workers = int(self.workers_input.text() or 5)
             self.db_path = self.dbfile_input.text().strip() or SAVE_DB_DEFAULT
+            self.engine = self.engine_input.currentText()
+            self.strategy = self.strategy_input.currentText()
+            self.roads_path = self.roads_input.text().strip()
         except ValueError:
             QMessageBox.critical(self, "Error", "Invalid input values")
             return
 
         self.init_db()
-        self.populate_coarse(north, south, east, west)
-        self.rate_limiter = RateLimiter(RATE_LIMIT_PER_MIN)
+        if self.strategy == 'roads':
+            if not self.roads_path or not os.path.exists(self.roads_path):
+                QMessageBox.critical(self, "Error", "Select a road extract file for the roads strategy")
+                return
+            try:
+                self.populate_roads(self.roads_path, north, south, east, west)
+            except (ImportError, ValueError, KeyError) as e:
+                QMessageBox.critical(self, "Error", f"Could not read road extract: {e}")
+                return
+        else:
+            self.populate_coarse(north, south, east, west, stage='quad' if self.strategy == 'quadtree' else 'coarse')
+        # shared with Tile_Downloader: both spend the same Street View quota
+        self.rate_limiter = get_rate_limiter("streetview", RATE_LIMIT_PER_MIN)
+        # keep-alive connections for the threaded engine, one per worker
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+        dedupe = self.strategy == 'grid' and fine_rings_collide()
+        if self.strategy == 'grid' and not dedupe:
+            logger.log_status(f"Fine rings at {FINE_SPACING} tile the {COARSE_SPACING} grid exactly: "
+                              f"no duplicate requests to skip, lattice dedup off")
+        self.writer = ScanResultWriter(self.db_path, dedupe=dedupe)
+        self.writer.start()
         self.scanning = True
 
         self.timer = QTimer(self)
@@ -190,25 +449,104 @@ class StreetViewDensityScanner(QWidget):
         self.thread.start()
 
     def scan_loop(widget):
-        while True:
-            conn = sqlite3.connect(widget.db_path)
-            cur = conn.cursor()
-            cur.execute("SELECT id,lat,lon,stage FROM coords WHERE scanned=0 ORDER BY stage DESC LIMIT ?", (widget.max_workers * 2,))
-            batch = cur.fetchall()
-            conn.close()
-            if not batch:
-                break
-
-            with ThreadPoolExecutor(max_workers=widget.max_workers) as ex:
-                for cid, lat, lon, stage in batch:
-                    ex.submit(widget.fetch_and_store, cid, lat, lon, stage)
-
-            # update UI after batch
-            widget.update_ui_signal.emit(False)
-
+        """
+        Keeps max_workers * 2 requests in flight on one long-lived pool.
+        Fine-stage children are scheduled ahead of the remaining coarse points
+        as soon as the writer has committed them. Once everything has been tried,
+        points that failed are tried again up to RETRY_PASSES times.
+        """
+        if widget.engine == "async":
+            return widget.async_scan_loop()
+
+        target = widget.max_workers * 2
+        feed = CoordFeed(widget.db_path, target)
+        in_flight = set()
+        retries_left = RETRY_PASSES
+        with ThreadPoolExecutor(max_workers=widget.max_workers) as ex:
+            while True:
+                feed.refill()
+                while len(in_flight) < target and not feed.empty():
+                    cid, lat, lon, stage, depth = feed.pop()
+                    in_flight.add(ex.submit(widget.fetch_and_store, cid, lat, lon, stage, depth))
+
+                if not in_flight:
+                    # Children only become visible once committed; drain the writer before giving up
+                    widget.writer.flush()
+                    feed.refill()
+                    if feed.empty() and retries_left:
+                        # whatever is still scanned=0 failed (request or write): ask once more
+                        retries_left -= 1
+                        feed.rewind()
+                        feed.refill()
+                    if feed.empty():
+                        break
+                    continue
+
+                done, in_flight = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception():
+                        logger.log_exception(f"Metadata request failed: {future.exception()}")
+
+        feed.close()
+        widget.finish_scan()
+
+    def async_scan_loop(widget):
+        """
+        Same scheduling as scan_loop, but requests run as asyncio tasks on one
+        pooled keep-alive session instead of a thread per request.
+        """
+        from metadata_client import AsyncMetadataClient
+
+        async def fetch_and_store(client, coord_id, lat, lon, stage, depth):
+            data = await client.fetch(lat, lon)
+            widget.store_result(coord_id, lat, lon, stage, depth, data)
+
+        async def run():
+            target = widget.max_workers * 2
+            feed = CoordFeed(widget.db_path, target)
+            in_flight = set()
+            retries_left = RETRY_PASSES
+            async with AsyncMetadataClient(widget.api_key, max_concurrency=widget.max_workers,
+                                           base_url=METADATA_URL, rate_limiter=widget.rate_limiter) as client:
+                while True:
+                    feed.refill()
+                    while len(in_flight) < target and not feed.empty():
+                        cid, lat, lon, stage, depth = feed.pop()
+                        in_flight.add(asyncio.ensure_future(fetch_and_store(client, cid, lat, lon, stage, depth)))
+
+                    if not in_flight:
+                        widget.writer.flush()
+                        feed.refill()
+                        if feed.empty() and retries_left:
+                            retries_left -= 1
+                            feed.rewind()
+                            feed.refill()
+                        if feed.empty():
+                            break
+                        continue
+
+                    done, in_flight = await asyncio.wait(in_flight, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception():
+                            logger.log_exception(f"Metadata request failed: {task.exception()}")
+            feed.close()
+
+        asyncio.run(run())
+        widget.finish_scan()
+
+    def finish_scan(widget):
+        widget.writer.stop()
+        stats = widget.writer.stats()
+        logger.log_status(f"Scan finished: {stats['requests_per_s']:.1f} req/s, "
+                          f"{stats['rows_committed_per_s']:.1f} rows/s committed, "
+                          f"{stats['saved_requests']} duplicate requests saved")
+        conn = sqlite3.connect(widget.db_path)
+        for stage, calls, panoramas in scan_efficiency(conn):
+            per_pano = f"{calls / panoramas:.1f}" if panoramas else "n/a"
+            logger.log_status(f"Stage {stage}: {calls} API calls, {panoramas} unique panoramas, {per_pano} calls per panorama")
+        conn.close()
         widget.scanning = False
         widget.update_ui_signal.emit(True)
-        
 
     def update_status_ui(self, final):
         conn = sqlite3.connect(self.db_path)
@@ -217,7 +555,13 @@ class StreetViewDensityScanner(QWidget):
         total = cur.fetchone()[0]
         cur.execute("SELECT COUNT(*) FROM coords WHERE scanned=1")
         done = cur.fetchone()[0]
-        self.status_label.setText(f"Scanned {done}/{total}")
+        stats = self.writer.stats()
+        self.status_label.setText(
+            f"Scanned {done}/{total} | {stats['requests_per_s']:.1f} req/s, "
+            f"{stats['rows_committed_per_s']:.1f} rows/s committed, backlog {stats['backlog']}, "
+            f"{stats['saved_requests']} duplicates skipped | "
+            f"limit {self.rate_limiter.rate_per_min():.0f}/min"
+        )
         self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(done)
 
@@ -231,38 +575,61 @@ class StreetViewDensityScanner(QWidget):
         self.refresh_map()
         if final:
             self.timer.stop()
-            self.status_label.setText("Scan completed")
+            conn = sqlite3.connect(self.db_path)
+            calls = sum(row[1] for row in scan_efficiency(conn))
+            panoramas = conn.execute("SELECT COUNT(*) FROM panoramas").fetchone()[0]
+            conn.close()
+            per_pano = f"{calls / panoramas:.1f}" if panoramas else "n/a"
+            self.status_label.setText(f"Scan completed: {calls} API calls, {panoramas} unique panoramas, {per_pano} calls per panorama")
 
     @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
     def safe_get(self, lat, lon):
-        return requests.get(
-            "https://maps.googleapis.com/maps/api/streetview/metadata",
+        """
+        Rate-limited metadata lookup. 429 and OVER_QUERY_LIMIT shrink the shared
+        limiter and raise so the call is retried; any other answer lets it regrow.
+        """
+        self.rate_limiter.acquire()
+        resp = self.session.get(
+            METADATA_URL,
             params={"location": f"{lat},{lon}", "key": self.api_key}, timeout=10
         )
+        if resp.status_code == 429:
+            self.rate_limiter.on_throttled()
+            raise RateLimitedError(f"HTTP 429 for {lat},{lon}")
+        data = resp.json()
+        if data.get("status") == "OVER_QUERY_LIMIT":
+            self.rate_limiter.on_throttled()
+            raise RateLimitedError(f"OVER_QUERY_LIMIT for {lat},{lon}")
+        self.rate_limiter.on_success()
+        return data
     
-    def fetch_and_store(self, coord_id, lat, lon, stage):
-        while not self.rate_limiter.acquire():
-            time.sleep(0.1)  # backoff or yield
-        
-        data = self.safe_get(lat=lat, lon=lon).json()
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("UPDATE coords SET scanned=1 WHERE id=?", (coord_id,))
-        print("Got to before data.get")
-        if data.get("status")=="OK":
-            print("Found one atleast")
-            cur.execute("INSERT INTO results(coord_id,pano_id) VALUES(?,?)", (coord_id, data.get("pano_id")))
-            if stage=='coarse':
-                for dlat in (-FINE_SPACING, 0, FINE_SPACING):
-                    for dlon in (-FINE_SPACING, 0, FINE_SPACING):
-                        if dlat==0 and dlon==0: continue
-                        cur.execute("INSERT INTO coords(lat,lon,stage) VALUES(?,?,?)", (lat+dlat, lon+dlon, 'fine'))
-                        print("Found one in fine")
-        
-        cur.execute("INSERT INTO responses(coord_id,response) VALUES(?,?)", (coord_id, data.get("status")))
-        
-        conn.commit()
-        conn.close()
+    def fetch_and_store(self, coord_id, lat, lon, stage, depth=0):
+        data = self.safe_get(lat=lat, lon=lon)
+        self.store_result(coord_id, lat, lon, stage, depth, data)
+
+    def store_result(self, coord_id, lat, lon, stage, depth, data):
+        """
+        Hand one metadata response to the writer, with the refinement children of a hit:
+        the fine ring around coarse points, or the four sub-cells of a quadtree cell.
+        """
+        status = data.get("status")
+        children = []
+        if status == "OK" and stage == 'coarse':
+            for dlat in (-FINE_SPACING, 0, FINE_SPACING):
+                for dlon in (-FINE_SPACING, 0, FINE_SPACING):
+                    if dlat==0 and dlon==0: continue
+                    children.append((lat+dlat, lon+dlon, 'fine', 1))
+        elif status == "OK" and stage == 'quad':
+            child_size = COARSE_SPACING / 2 ** (depth + 1)
+            if child_size >= MIN_SPACING:
+                offset = child_size / 2
+                for dlat in (-offset, offset):
+                    for dlon in (-offset, offset):
+                        children.append((lat+dlat, lon+dlon, 'quad', depth + 1))
+
+        location = data.get("location") or {}
+        pano_location = (location["lat"], location["lng"]) if "lat" in location else (lat, lon)
+        self.writer.put(coord_id, status, data.get("pano_id"), pano_location, children)
 
     def refresh_map(self):
         conn = sqlite3.connect(self.db_path)
@@ -279,7 +646,7 @@ class StreetViewDensityScanner(QWidget):
         m = folium.Map(location=(avg_lat, avg_lon), zoom_start=13)
 
         for lat, lon, stage, scanned in records:
-            color = 'green' if (scanned and stage=='coarse') else 'blue' if (scanned and stage=='fine') else 'gray'
+            color = 'green' if (scanned and stage=='coarse') else 'blue' if (scanned and stage=='fine') else 'purple' if (scanned and stage=='quad') else 'orange' if (scanned and stage=='road') else 'gray'
             folium.CircleMarker((lat, lon), radius=3, color=color, fill=True).add_to(m)
         
         m.save(self.map_file)
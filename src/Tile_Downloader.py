@@ -1,12 +1,20 @@
 # Tile downloader for Google Street View panoramas
 # Usage:
-#   from tile_downloader import download_panorama
-#   download_panorama('PANO_ID_HERE', 'output.jpg', zoom=5)
+#   from Tile_Downloader import download_panorama
+#   download_panorama('PANO_ID_HERE', 'output_dir', (lat, lng))                          # six Static API faces, reprojected
+#   download_panorama('PANO_ID_HERE', 'output_dir', (lat, lng), method='tiles', zoom=3)  # tile grid, stitched
 
 import os
 import math
+import time
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import cv2
+from functools import lru_cache
 from io import BytesIO
 from PIL import Image
 from utils import resolve_path
@@ -23,45 +31,149 @@ config = Config(logger)
 
 region = config.get_general_data()['region']
 
+from rate_limiter import get_rate_limiter
+from face_cache import FaceCache
+# shared with the metadata scanner: both spend the same Street View quota
+rate_limiter = get_rate_limiter("streetview", config.get_rate_limit_per_min())
 
-def fetch_cube_faces(pano_id: str, logger=None):
+STATIC_URL = "https://maps.googleapis.com/maps/api/streetview"
+
+# (name, heading, pitch) of the six faces requested from the Static API
+FACE_VIEWS = [
+    ("front", 0, 0), ("right", 90, 0), ("back", 180, 0), ("left", 270, 0),
+    ("up", 0, 90), ("down", 0, -90),
+]
+
+# One keep-alive pool for every face request; sized for several panoramas in flight
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=32))
+
+# The tile endpoint is not the Static API: its own quota, bucket and connection pool, so a
+# zoom-3 panorama (32 tiles) does not eat the scanner's budget or its connections
+TILE_POOL_SIZE = 32
+tile_rate_limiter = get_rate_limiter("tiles", config.get_tile_rate_limit_per_min())
+tile_session = requests.Session()
+tile_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=TILE_POOL_SIZE))
+tile_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=TILE_POOL_SIZE))
+
+
+_face_cache = None
+_face_cache_lock = threading.Lock()
+
+def get_face_cache():
     """
-    Fetch the six cube faces from the Static API:
-      headings 0,90,180,270 at pitch=0 → front, right, back, left
-      plus pitch=+90 (up) and pitch=-90 (down)
-    Returns dict of PIL Images.
+    The process-wide FaceCache, opened on first use; None when face_cache_max_mb is 0.
     """
-    BASE_URL = "https://maps.googleapis.com/maps/api/streetview"
-    FACE_SIZE = int(config.get_download_data()['face_size'])
-    key = os.getenv("API_KEY")
+    global _face_cache
+    with _face_cache_lock:
+        if _face_cache is None:
+            max_mb = float(config.get("Download", "face_cache_max_mb", fallback="2048"))
+            if max_mb <= 0:
+                return None
+            _face_cache = FaceCache(config.get_face_cache_path(), int(max_mb * 1024 * 1024))
+        return _face_cache
+
+
+def face_bytes(pano_id: str, heading: int, pitch: int, FACE_SIZE: int, logger=None) -> bytes:
+    """
+    JPEG bytes of one face, from the face cache if it has it. safe_get retries
+    it on its own, so one slow or failing face does not restart the others.
+    """
+    cache = get_face_cache()
+    data = cache.get(pano_id, heading, pitch, FACE_SIZE) if cache else None
+    if data is None:
+        data = request_face(pano_id, heading, pitch, FACE_SIZE, logger)
+        if cache:
+            cache.put(pano_id, heading, pitch, FACE_SIZE, data)
+    return data
+
+
+def fetch_face(pano_id: str, heading: int, pitch: int, FACE_SIZE: int, logger=None) -> Image.Image:
+    img = Image.open(BytesIO(face_bytes(pano_id, heading, pitch, FACE_SIZE, logger)))
+    img.load()  # decode here, in parallel with the other faces
+    return img
+
+
+def request_face(pano_id: str, heading: int, pitch: int, FACE_SIZE: int, logger=None) -> bytes:
     params = {
         "size": f"{FACE_SIZE}x{FACE_SIZE}",
         "pano": pano_id,
         "fov": 90,
-        "key": key
+        "heading": heading,
+        "pitch": pitch,
+        "key": os.getenv("API_KEY")
     }
-    faces = {}
+    resp = safe_get(STATIC_URL, params=params, logger=logger)
+    return resp.content
 
-    # equator faces
-    for heading, name in [(0, "front"), (90, "right"), (180, "back"), (270, "left")]:
-        params.update({"heading": heading, "pitch": 0})
-        resp = safe_get(BASE_URL, params=params, logger=logger)
-        faces[name] = Image.open(BytesIO(resp.content))
 
-    # up/down
-    for pitch, name in [(90, "up"), (-90, "down")]:
-        params.update({"heading": 0, "pitch": pitch})
-        resp = safe_get(BASE_URL, params=params, logger=logger)
-        faces[name] = Image.open(BytesIO(resp.content))
+def fetch_cube_faces(pano_id: str, logger=None, FACE_SIZE=None):
+    """
+    Fetch the six cube faces from the Static API:
+      headings 0,90,180,270 at pitch=0 → front, right, back, left
+      plus pitch=+90 (up) and pitch=-90 (down)
+    All six requests run concurrently over the shared session.
+    Returns dict of PIL Images.
+    """
+    FACE_SIZE = int(FACE_SIZE or config.get_download_data()['face_size'])
+    with ThreadPoolExecutor(max_workers=len(FACE_VIEWS)) as pool:
+        futures = {name: pool.submit(fetch_face, pano_id, heading, pitch, FACE_SIZE, logger)
+                   for name, heading, pitch in FACE_VIEWS}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def new_face_buffer(FACE_SIZE: int) -> np.ndarray:
+    """
+    Uninitialised (6*F*F + 1, 3) uint8 buffer for the six faces in FACE_ORDER.
+    The extra last row is black, for output pixels that no face covers.
+    """
+    buf = np.empty((6 * FACE_SIZE * FACE_SIZE + 1, 3), dtype=np.uint8)
+    buf[-1] = 0
+    return buf
 
-    return faces
+
+def face_slots(buf: np.ndarray, FACE_SIZE: int) -> np.ndarray:
+    """(6, F, F, 3) view of a face buffer; slot i holds FACE_ORDER[i]."""
+    return buf[:-1].reshape(6, FACE_SIZE, FACE_SIZE, 3)
+
+
+def decode_face_into(data: bytes, slot: np.ndarray):
+    """
+    Decode JPEG bytes as BGR into one slot of a face buffer.
+    OpenCV has no decode-into-buffer call, so this is the one copy a face makes.
+    """
+    face = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if face is None or face.shape != slot.shape:
+        raise ValueError(f"Face decoded to {None if face is None else face.shape}, expected {slot.shape}")
+    slot[...] = face
+
+
+def fetch_cube_faces_into(pano_id: str, logger=None, FACE_SIZE=None) -> np.ndarray:
+    """
+    Fetch the six faces concurrently and decode each straight into its slot of one
+    new face buffer (BGR, as they come from the API: no orientation fix-up, the
+    remap tables account for it). Returns the buffer for reproject_stacked.
+    """
+    FACE_SIZE = int(FACE_SIZE or config.get_download_data()['face_size'])
+    buf = new_face_buffer(FACE_SIZE)
+    slots = face_slots(buf, FACE_SIZE)
+    views = {name: (heading, pitch) for name, heading, pitch in FACE_VIEWS}
+
+    def fetch_into(idx, name):
+        heading, pitch = views[name]
+        decode_face_into(face_bytes(pano_id, heading, pitch, FACE_SIZE, logger), slots[idx])
+
+    with ThreadPoolExecutor(max_workers=len(FACE_ORDER)) as pool:
+        for future in [pool.submit(fetch_into, idx, name) for idx, name in enumerate(FACE_ORDER)]:
+            future.result()
+    return buf
 
 def retry_if_5xx_error(exception):
-    """Return True if exception is HTTPError with status 5xx."""
+    """Return True if exception is HTTPError with status 5xx or 429."""
     return (
         isinstance(exception, requests.exceptions.HTTPError)
         and exception.response is not None
-        and 500 <= exception.response.status_code < 600
+        and (500 <= exception.response.status_code < 600 or exception.response.status_code == 429)
     )
 
 @retry(
@@ -69,13 +181,24 @@ def retry_if_5xx_error(exception):
     stop=stop_after_attempt(3),
     retry=retry_if_exception(retry_if_5xx_error)
 )
-def safe_get(url, params, logger=None):
+def safe_get(url, params, logger=None, limiter=None, http=None):
+    # limiter/http default to the Street View bucket and session
+    limiter = limiter or rate_limiter
+    http = http or session
     try:
-        resp = requests.get(url, params=params, timeout=10)
+        limiter.acquire()
+        resp = http.get(url, params=params, timeout=10)
         if 200 <= resp.status_code < 300:
+            limiter.on_success()
             if logger:
                 logger.log_status(f"✅ Success {resp.status_code} for {resp.url}")
             return resp
+        elif resp.status_code == 429:
+            # Throttled: shrink the shared rate, then retry
+            limiter.on_throttled()
+            if logger:
+                logger.log_status(f"⚠️ Rate limited {resp.status_code} for {resp.url}, retrying...")
+            resp.raise_for_status()
         elif 400 <= resp.status_code < 500:
             # Don’t retry
             if logger:
@@ -91,25 +214,20 @@ def safe_get(url, params, logger=None):
             logger.log_status(f"❌ Request failed for {url}: {e}")
         raise
 
-def orient_faces(faces: dict[str,Image.Image]) -> dict[str,Image.Image]:
-    """
-    Rotate/flip the raw cube faces so that sampling them with your existing
-    uc/vc math produces correctly oriented output.
-    """
-    faces["front"] = faces["front"].rotate(180, expand=False)
-    faces["back"]  = faces["back"].rotate(180,  expand=False)
-    faces["left"]  = faces["left"].rotate(180, expand=False)
-    faces["right"] = faces["right"].rotate(180, expand=False)
-    return faces
+FACE_ORDER = ("front", "right", "back", "left", "up", "down")
+# The four horizontal faces come from the API upside down relative to the uc/vc math
+# below. Instead of rotating their pixels, the remap tables read them at (F-1-u, F-1-v).
+ROTATED_FACES = (0, 1, 2, 3)
+REMAP_INTERPOLATION = config.get("Download", "remap_interpolation", fallback="nearest")
+
 
-def cube_to_equirectangular(faces: dict, FACE_SIZE = int(config.get_download_data()['face_size'])):
+def _face_coords(face_size: int):
     """
-    Reproject 6 cube faces (dict with keys front, right, back, left, up, down)
-    into one equirectangular image of size (4*FACE_SIZE, 2*FACE_SIZE).
+    For every pixel of the (2F, 4F) equirectangular output: which cube face it
+    comes from (index into FACE_ORDER, -1 if none) and the float source pixel (u, v) on it.
     """
-    W = 4 * FACE_SIZE
-    H = 2 * FACE_SIZE
-    # Prepare output pixel grid
+    W = 4 * face_size
+    H = 2 * face_size
     ys, xs = np.indices((H, W), dtype=np.float32)
     lon = (xs / W) * 2 * math.pi - math.pi
     lat = math.pi/2 - (ys / H) * math.pi
@@ -118,72 +236,435 @@ def cube_to_equirectangular(faces: dict, FACE_SIZE = int(config.get_download_dat
     x = np.cos(lat) * np.cos(lon)
     y = np.cos(lat) * np.sin(lon)
     z = np.sin(lat)
-
-    # Which face?
     abs_x, abs_y, abs_z = np.abs(x), np.abs(y), np.abs(z)
-    # Initialize empty arrays
-    out = np.zeros((H, W, 3), dtype=np.uint8)
-
-    def sample(face_img, uc, vc):
-        # uc, vc are floats in [-1,1] for face coords → map to [0, FACE_SIZE)
-        u = ((uc + 1) / 2) * (FACE_SIZE - 1)
-        v = ((vc + 1) / 2) * (FACE_SIZE - 1)
-        u = np.clip(np.round(u).astype(int), 0, FACE_SIZE-1)
-        v = np.clip(np.round(v).astype(int), 0, FACE_SIZE-1)
-        arr = np.array(face_img)
-        return arr[v, u]
-
-    faces = orient_faces(faces=faces)
-
-    # Front face: +X major
-    mask = (abs_x >= abs_y) & (abs_x >= abs_z) & (x > 0)
-    uc = -y[mask] / abs_x[mask]
-    vc =  z[mask] / abs_x[mask]
-    out[mask] = sample(faces["front"], uc, vc)
-
-    # Back face: -X major
-    mask = (abs_x >= abs_y) & (abs_x >= abs_z) & (x < 0)
-    uc =  y[mask] / abs_x[mask]
-    vc =  z[mask] / abs_x[mask]
-    out[mask] = sample(faces["back"], uc, vc)
-
-    # Right face: +Y major
-    mask = (abs_y > abs_x) & (abs_y >= abs_z) & (y > 0)
-    uc =  x[mask] / abs_y[mask]
-    vc =  z[mask] / abs_y[mask]
-    out[mask] = sample(faces["right"], uc, vc)
-
-    # Left face: -Y major
-    mask = (abs_y > abs_x) & (abs_y >= abs_z) & (y < 0)
-    uc = -x[mask] / abs_y[mask]
-    vc =  z[mask] / abs_y[mask]
-    out[mask] = sample(faces["left"], uc, vc)
-
-    # Up face: +Z major
-    mask = (abs_z > abs_x) & (abs_z > abs_y) & (z > 0)
-    uc =  y[mask] / abs_z[mask]
-    vc =  x[mask] / abs_z[mask]
-    out[mask] = sample(faces["up"], uc, vc)
-
-    # Down face: -Z major
-    mask = (abs_z > abs_x) & (abs_z > abs_y) & (z < 0)
-    uc =  y[mask] / abs_z[mask]
-    vc = -x[mask] / abs_z[mask]
-    out[mask] = sample(faces["down"], uc, vc)
-
-    return Image.fromarray(out)
-
-def download_panorama(pano_id: str, save_dir: str, coords: tuple[float,float], face):
+
+    # (mask, uc, vc) per face in FACE_ORDER; uc, vc in [-1, 1]
+    projections = [
+        # Front face: +X major
+        ((abs_x >= abs_y) & (abs_x >= abs_z) & (x > 0), lambda m: (-y[m] / abs_x[m],  z[m] / abs_x[m])),
+        # Right face: +Y major
+        ((abs_y > abs_x) & (abs_y >= abs_z) & (y > 0),  lambda m: ( x[m] / abs_y[m],  z[m] / abs_y[m])),
+        # Back face: -X major
+        ((abs_x >= abs_y) & (abs_x >= abs_z) & (x < 0), lambda m: ( y[m] / abs_x[m],  z[m] / abs_x[m])),
+        # Left face: -Y major
+        ((abs_y > abs_x) & (abs_y >= abs_z) & (y < 0),  lambda m: (-x[m] / abs_y[m],  z[m] / abs_y[m])),
+        # Up face: +Z major
+        ((abs_z > abs_x) & (abs_z > abs_y) & (z > 0),   lambda m: ( y[m] / abs_z[m],  x[m] / abs_z[m])),
+        # Down face: -Z major
+        ((abs_z > abs_x) & (abs_z > abs_y) & (z < 0),   lambda m: ( y[m] / abs_z[m], -x[m] / abs_z[m])),
+    ]
+
+    face = np.full((H, W), -1, dtype=np.int8)
+    u = np.zeros((H, W), dtype=np.float32)
+    v = np.zeros((H, W), dtype=np.float32)
+    for idx, (mask, coords) in enumerate(projections):
+        uc, vc = coords(mask)
+        face[mask] = idx
+        # map [-1,1] → [0, FACE_SIZE-1]
+        u[mask] = ((uc + 1) / 2) * (face_size - 1)
+        v[mask] = ((vc + 1) / 2) * (face_size - 1)
+    return face, u, v
+
+
+# one map per worker process: at F=2048 it is 134 MB (nearest) / 201 MB (bilinear)
+@lru_cache(maxsize=1)
+def equirect_remap_table(face_size: int) -> np.ndarray:
+    """
+    Nearest-neighbour cv2.remap map for the faces stacked as one (6F, F) strip: the
+    integer (x, y) source pixel of every output pixel as int16 pairs, 4 bytes per output
+    pixel. Depends only on the face size, so it is built once per size.
+    """
+    face, u, v = _face_coords(face_size)
+    u = np.clip(np.round(u), 0, face_size - 1)
+    v = np.clip(np.round(v), 0, face_size - 1)
+    rotated = np.isin(face, ROTATED_FACES)
+    u[rotated] = face_size - 1 - u[rotated]
+    v[rotated] = face_size - 1 - v[rotated]
+    map_x = u
+    map_y = face.astype(np.float32) * face_size + v
+    map_x[face < 0] = -1  # outside the strip → black border
+    map_y[face < 0] = -1
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=True)[0]
+
+
+@lru_cache(maxsize=1)
+def equirect_remap_maps(face_size: int):
+    """
+    cv2.remap map pair for bilinear sampling of the faces stacked as one (6F, F) strip.
+    u, v stay inside [0, F-1], so the interpolation never bleeds into the next face.
+    """
+    face, u, v = _face_coords(face_size)
+    rotated = np.isin(face, ROTATED_FACES)
+    u[rotated] = face_size - 1 - u[rotated]
+    v[rotated] = face_size - 1 - v[rotated]
+    map_x = u
+    map_y = face.astype(np.float32) * face_size + v
+    map_x[face < 0] = -1  # outside the strip → black border
+    map_y[face < 0] = -1
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+def stack_faces(faces: dict, FACE_SIZE: int) -> np.ndarray:
+    """
+    Copy six PIL faces, as fetched, into a new face buffer in FACE_ORDER.
+    """
+    buf = new_face_buffer(FACE_SIZE)
+    stacked = face_slots(buf, FACE_SIZE)
+    for idx, name in enumerate(FACE_ORDER):
+        img = faces[name]
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        stacked[idx] = np.asarray(img)
+    return buf
+
+
+def cube_to_equirectangular(faces: dict, FACE_SIZE = int(config.get_download_data()['face_size']), interpolation=None):
+    """
+    Reproject 6 cube faces (dict with keys front, right, back, left, up, down)
+    into one equirectangular image of size (4*FACE_SIZE, 2*FACE_SIZE).
+    interpolation is "nearest" (default) or "bilinear".
+    """
+    FACE_SIZE = int(FACE_SIZE)
+    buf = stack_faces(faces, FACE_SIZE)
+    return Image.fromarray(reproject_stacked(buf, FACE_SIZE, interpolation))
+
+
+def reproject_stacked(buf: np.ndarray, FACE_SIZE: int, interpolation=None) -> np.ndarray:
+    """
+    Equirectangular (2F, 4F, 3) array from a face buffer, in the buffer's channel order.
+    Top-level and array-in/array-out so it can run in a worker process.
+    """
+    interpolation = interpolation or REMAP_INTERPOLATION
+    strip = buf[:-1].reshape(6 * FACE_SIZE, FACE_SIZE, 3)
+    if interpolation == "bilinear":
+        map1, map2 = equirect_remap_maps(FACE_SIZE)
+        return cv2.remap(strip, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return cv2.remap(strip, equirect_remap_table(FACE_SIZE), None, cv2.INTER_NEAREST,
+                     borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+def benchmark_remap(face_sizes=(512, 1024, 2048), repeats=5):
+    """
+    Time cube_to_equirectangular on random faces. The first call per size builds
+    the remap table and is reported separately from the steady-state ms/pano.
+    """
+    results = {}
+    rng = np.random.default_rng(0)
+    for size in face_sizes:
+        faces = {name: Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+                 for name in FACE_ORDER}
+        for interpolation in ("nearest", "bilinear"):
+            equirect_remap_table.cache_clear()
+            equirect_remap_maps.cache_clear()
+            start = time.perf_counter()
+            cube_to_equirectangular(dict(faces), size, interpolation)
+            first = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                cube_to_equirectangular(dict(faces), size, interpolation)
+            per_pano = (time.perf_counter() - start) * 1000 / repeats
+
+            results[(size, interpolation)] = (first, per_pano)
+            logger.log_status(f"remap {size}px {interpolation}: first call {first:.0f} ms, {per_pano:.1f} ms/pano")
+            print(f"face {size:>4} {interpolation:<8} first call {first:8.0f} ms   {per_pano:8.1f} ms/pano")
+    equirect_remap_table.cache_clear()
+    equirect_remap_maps.cache_clear()
+    return results
+
+def _current_rss_mb():
+    """Resident set size of this process in MB, or None where it cannot be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _legacy_panorama(face_data: dict, FACE_SIZE: int) -> bytes:
+    # the pre-buffer path, kept for benchmark_memory: PIL decode, rotate copies,
+    # np.asarray copies, stack, gather, Image.fromarray copy, PIL encode
+    faces = {name: Image.open(BytesIO(data)) for name, data in face_data.items()}
+    for name in ("front", "back", "left", "right"):
+        faces[name] = faces[name].rotate(180, expand=False)
+    buf = np.zeros((6 * FACE_SIZE * FACE_SIZE + 1, 3), dtype=np.uint8)
+    stacked = face_slots(buf, FACE_SIZE)
+    for idx, name in enumerate(FACE_ORDER):
+        stacked[idx] = np.array(faces[name])
+    eq = Image.fromarray(reproject_stacked(buf, FACE_SIZE, "nearest"))
+    out = BytesIO()
+    eq.save(out, "JPEG")
+    return out.getvalue()
+
+
+def _buffer_panorama(face_data: dict, FACE_SIZE: int) -> bytes:
+    buf = new_face_buffer(FACE_SIZE)
+    slots = face_slots(buf, FACE_SIZE)
+    for idx, name in enumerate(FACE_ORDER):
+        decode_face_into(face_data[name], slots[idx])
+    eq = reproject_stacked(buf, FACE_SIZE, "nearest")
+    ok, encoded = cv2.imencode(".jpg", eq, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return encoded.tobytes()
+
+
+def _measure_rss(variant: str, FACE_SIZE: int, concurrent: int):
+    """
+    Runs in a fresh process: peak RSS growth while `concurrent` panoramas go through
+    one path at once, sampled every 2 ms. Returns (MB per panorama, seconds) or None.
+    """
+    rng = np.random.default_rng(0)
+    face_data = {}
+    for name in FACE_ORDER:
+        noise = cv2.GaussianBlur(rng.integers(0, 256, (FACE_SIZE, FACE_SIZE, 3), dtype=np.uint8), (9, 9), 3)
+        face_data[name] = cv2.imencode(".jpg", noise)[1].tobytes()
+    run = _legacy_panorama if variant == "before" else _buffer_panorama
+    run(face_data, FACE_SIZE)  # builds the remap table and warms the allocators
+
+    base = _current_rss_mb()
+    if base is None:
+        return None
+    peak = [base]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _current_rss_mb())
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrent) as pool:
+        list(pool.map(lambda _: run(face_data, FACE_SIZE), range(concurrent)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return (peak[0] - base) / concurrent, elapsed
+
+
+def benchmark_memory(face_size=1024, concurrent=4):
+    """
+    Peak RSS per concurrent panorama for the old PIL path vs. the face-buffer path.
+    Each variant runs in its own process so the high-water marks do not mix.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    results = {}
+    for variant in ("before", "after"):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[variant] = pool.submit(_measure_rss, variant, face_size, concurrent).result()
+        if results[variant] is None:
+            print("RSS cannot be read on this platform (install psutil)")
+            return results
+        mb, seconds = results[variant]
+        logger.log_status(f"memory {variant}: {mb:.0f} MB peak RSS per panorama at {face_size}px, {concurrent} concurrent")
+        print(f"{variant:<6} {mb:8.0f} MB peak RSS / panorama   {seconds:6.2f} s for {concurrent} panoramas")
+    return results
+
+
+JPEG_QUALITY = 75  # PIL's default, which panoramas were saved with before
+
+def panorama_path(save_dir: str, pano_id: str, coords: tuple[float,float]) -> str:
+    lat, lng = coords
     region = config.get_general_data()['region']
+    return os.path.join(save_dir, f"{region}_{pano_id}_{lat}_{lng}_360.jpg")
+
+
+def save_panorama(eq: np.ndarray, path: str) -> tuple[int, str]:
+    """
+    JPEG-encode a BGR panorama and write it atomically: the bytes go to path + '.tmp'
+    and are renamed over path, so a crash never leaves a truncated image under the final name.
+    Returns (bytes written, sha256 hex digest).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    ok, encoded = cv2.imencode(".jpg", eq, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError(f"Could not encode panorama for {path}")
+    return write_atomic(path, encoded.data)
+
+
+def write_atomic(path: str, data) -> tuple[int, str]:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+# --- cube-face output mode ---
+
+def parse_face_views(text: str) -> list[tuple[int, int]]:
+    """
+    "0:0,90:0,180:0,270:0" → [(heading, pitch), ...]
+    """
+    views = []
+    for item in text.split(","):
+        if item.strip():
+            heading, pitch = item.split(":")
+            views.append((int(heading), int(pitch)))
+    return views
+
+
+OUTPUT_MODE = config.get("Download", "output_mode", fallback="equirect")
+OUTPUT_FACE_VIEWS = parse_face_views(config.get("Download", "face_views", fallback="0:0,90:0,180:0,270:0"))
+
+
+def face_path(save_dir: str, pano_id: str, coords: tuple[float,float], heading: int, pitch: int) -> str:
+    lat, lng = coords
+    region = config.get_general_data()['region']
+    return os.path.join(save_dir, f"{region}_{pano_id}_{lat}_{lng}_h{heading}_p{pitch}.jpg")
+
+
+def save_face_views(pano_id: str, save_dir: str, coords: tuple[float,float], views=None, FACE_SIZE=None, logger=None) -> list[dict]:
+    """
+    Fetch the (heading, pitch) views concurrently and write the API's JPEG bytes as they
+    are: no decode, reprojection or re-encode. Returns one faces_manifest entry per view,
+    plus its byte count and sha256.
+    """
+    views = views or OUTPUT_FACE_VIEWS
+    FACE_SIZE = int(FACE_SIZE or config.get_download_data()['face_size'])
+    os.makedirs(save_dir, exist_ok=True)
+    lat, lng = coords
+
+    def save_view(heading, pitch):
+        path = face_path(save_dir, pano_id, coords, heading, pitch)
+        size, checksum = write_atomic(path, face_bytes(pano_id, heading, pitch, FACE_SIZE, logger))
+        return {"file": os.path.basename(path), "pano_id": pano_id, "lat": lat, "lng": lng,
+                "heading": heading, "pitch": pitch, "size": FACE_SIZE,
+                "bytes": size, "sha256": checksum}
+
+    with ThreadPoolExecutor(max_workers=len(views)) as pool:
+        futures = [pool.submit(save_view, heading, pitch) for heading, pitch in views]
+        return [future.result() for future in futures]
+
+
+# --- tile path ---
+
+DOWNLOAD_METHOD = config.get("Download", "download_method", fallback="cube")
+TILE_ZOOM = int(config.get("Download", "tile_zoom", fallback="3"))
+TILE_URL = config.get("Download", "tile_base_url", fallback="https://cbk0.google.com/cbk")
+TILE_WORKERS = int(config.get("Download", "tile_workers", fallback="16"))
+
+
+class TileSource:
+    """
+    Where equirectangular panorama tiles come from. At zoom z the panorama is a grid of
+    2^z x 2^(z-1) tiles of tile_size pixels. base_url can point at a local stub that
+    answers the same query parameters; subclass and override request() for other layouts.
+    """
+    def __init__(self, base_url=None, tile_size=512):
+        self.base_url = base_url or TILE_URL
+        self.tile_size = tile_size
+
+    def grid(self, zoom: int) -> tuple[int, int]:
+        """(columns, rows) of the tile grid."""
+        return 2 ** zoom, max(1, 2 ** (zoom - 1))
+
+    def request(self, pano_id: str, zoom: int, x: int, y: int) -> tuple[str, dict]:
+        return self.base_url, {"output": "tile", "panoid": pano_id, "zoom": zoom, "x": x, "y": y}
+
+
+def fetch_panorama_tiles(pano_id: str, zoom=None, source: TileSource = None, logger=None, workers=None) -> np.ndarray:
+    """
+    Fetch the whole tile grid concurrently over the tile session and decode every tile
+    straight into its place on one preallocated BGR canvas. The result is already
+    equirectangular, so there is no reprojection step. Tiles the server does not have
+    (older, narrower panoramas) stay black. workers caps the concurrent requests below
+    tile_workers; callers fetching several panoramas at once share TILE_POOL_SIZE out.
+    """
+    zoom = TILE_ZOOM if zoom is None else int(zoom)
+    source = source or TileSource()
+    cols, rows = source.grid(zoom)
+    size = source.tile_size
+    canvas = np.zeros((rows * size, cols * size, 3), dtype=np.uint8)
+
+    def fetch_tile(x, y):
+        url, params = source.request(pano_id, zoom, x, y)
+        try:
+            resp = safe_get(url, params=params, logger=logger, limiter=tile_rate_limiter, http=tile_session)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code in (400, 404):
+                return
+            raise
+        tile = cv2.imdecode(np.frombuffer(resp.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if tile is None:
+            raise ValueError(f"Tile {x},{y} of {pano_id} could not be decoded")
+        h, w = min(tile.shape[0], size), min(tile.shape[1], size)
+        canvas[y * size:y * size + h, x * size:x * size + w] = tile[:h, :w]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(TILE_WORKERS, workers or TILE_WORKERS, cols * rows))) as pool:
+        futures = [pool.submit(fetch_tile, x, y) for y in range(rows) for x in range(cols)]
+        for future in futures:
+            future.result()
+    return canvas
+
+
+def benchmark_fetch_methods(pano_id: str, zoom=None, FACE_SIZE=None, repeats=3, source: TileSource = None):
+    """
+    Wall-clock per panorama of the cube-face path (fetch + reproject) against the tile
+    path (fetch + stitch), both ending in an equirectangular array. Uses STATIC_URL and
+    the tile source as configured, so either can be pointed at a local stub.
+    """
+    zoom = TILE_ZOOM if zoom is None else int(zoom)
+    FACE_SIZE = int(FACE_SIZE or config.get_download_data()['face_size'])
+    results = {}
+    for method in ("cube", "tiles"):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            if method == "cube":
+                eq = reproject_stacked(fetch_cube_faces_into(pano_id, FACE_SIZE=FACE_SIZE), FACE_SIZE)
+            else:
+                eq = fetch_panorama_tiles(pano_id, zoom, source)
+        per_pano = (time.perf_counter() - start) / repeats
+        results[method] = (per_pano, eq.shape)
+        logger.log_status(f"fetch {method}: {per_pano:.2f} s/pano, output {eq.shape[1]}x{eq.shape[0]}")
+        print(f"{method:<6} {per_pano:6.2f} s/pano   output {eq.shape[1]}x{eq.shape[0]}")
+    return results
+
+
+def download_panorama(pano_id: str, save_dir: str, coords: tuple[float,float], face=None, method=None, zoom=None):
+    """
+    Fetch, reproject and save one panorama, from the six cube faces (method 'cube') or
+    the tile grid at the given zoom (method 'tiles', no reprojection).
+    Returns the wall-clock breakdown in seconds (network, reproject, encode, total),
+    or None if the download failed.
+    """
     logger.log_status("Started Panaroma Download")
+    face = int(face or config.get_download_data()['face_size'])
+    method = method or DOWNLOAD_METHOD
     try:
-        faces = fetch_cube_faces(pano_id, logger=logger)
-        eq = cube_to_equirectangular(faces, face)
-        lat, lng = coords
-        os.makedirs(save_dir, exist_ok=True)
-        filename = f"{region}_{pano_id}_{lat}_{lng}_360.jpg"
-        path = os.path.join(save_dir, filename)
-        eq.save(path, "JPEG")
-        logger.log_status(f"Panaromas Downloaded successfully to {path}")
+        start = time.perf_counter()
+        if method == "tiles":
+            eq = fetch_panorama_tiles(pano_id, zoom, logger=logger)
+            fetched = reprojected = time.perf_counter()
+        else:
+            buf = fetch_cube_faces_into(pano_id, logger=logger, FACE_SIZE=face)
+            fetched = time.perf_counter()
+            eq = reproject_stacked(buf, face)
+            reprojected = time.perf_counter()
+        path = panorama_path(save_dir, pano_id, coords)
+        save_panorama(eq, path)
+        done = time.perf_counter()
+
+        timings = {
+            "network": fetched - start,
+            "reproject": reprojected - fetched,
+            "encode": done - reprojected,
+            "total": done - start,
+        }
+        logger.log_status(f"Panaromas Downloaded successfully to {path} "
+                          f"(network {timings['network']:.2f}s, reproject {timings['reproject']:.2f}s, "
+                          f"encode {timings['encode']:.2f}s)")
+        return timings
     except Exception as e:
         logger.log_exception(f"Error while downloading Panaromas: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    benchmark_remap()
+    benchmark_memory()
@@ -62,13 +62,32 @@ class Config:
                 "map_index_path": "index_map.json",
                 "classification_save_folder_path": "data\\Classified",
                 "metadata_database_path": "scan_data.db",
+                "face_cache_path": "data\\face_cache",
+                "gazetteer_path": "data\\gazetteer.db",
                 "secrets_path": "secrets.env"
             }
 
             self.parser["Download"] = {
                 "face_size": "1024",
+                "remap_interpolation": "nearest",
+                "download_workers": "4",
+                "reproject_processes": "2",
+                "face_cache_max_mb": "2048",
+                "output_mode": "equirect",
+                "face_views": "0:0,90:0,180:0,270:0",
+                "download_method": "cube",
+                "tile_zoom": "3",
+                "tile_base_url": "https://cbk0.google.com/cbk",
+                "tile_workers": "16",
                 "coarse_spacing": "0.003",
                 "fine_spacing": "0.001",
+                "rate_limit_per_min": "30000",
+                "scan_retry_passes": "1",
+                "tile_rate_limit_per_min": "30000",
+                "scan_strategy": "grid",
+                "min_spacing": "0.0005",
+                "road_extract_path": "",
+                "road_spacing_m": "20",
                 "file_name": "map.html"
             }
 
@@ -81,7 +100,12 @@ class Config:
                 "output_dir": "data\\detected",
                 "threshold": "0.3",
                 "expand_factor": "0.1",
-                "min_dim": "200"
+                "min_dim": "200",
+                "batch_size": "4",
+                "decode_threads": "2",
+                "prefetch": "2",
+                "input_policy": "fixed",
+                "input_size": "3600"
             }
 
             self.parser["Duplicates"] = {
@@ -109,7 +133,13 @@ class Config:
 
             self.parser["Processed"] = {
                 "input_folder": "data\\Raw",
-                "save_folder": "data\\Processed"
+                "save_folder": "data\\Processed",
+                "crop_processes": "4",
+                "crop_chunk_size": "8",
+                "crop_method": "auto",
+                "fused_detection": "False",
+                "save_crops": "False",
+                "fused_queue_size": "4"
             }
 
             self.parser["Model_Training"] = {
@@ -344,6 +374,22 @@ class Config:
     def get_bd_min_dim(self) -> int:
         return int(self.get("BUILDING_DETECTION", "min_dim", fallback="200"))
 
+    def get_bd_batch_size(self) -> int:
+        return int(self.get("BUILDING_DETECTION", "batch_size", fallback="4"))
+
+    def get_bd_decode_threads(self) -> int:
+        return int(self.get("BUILDING_DETECTION", "decode_threads", fallback="2"))
+
+    def get_bd_prefetch(self) -> int:
+        return int(self.get("BUILDING_DETECTION", "prefetch", fallback="2"))
+
+    def get_bd_input_policy(self) -> str:
+        # fixed | native | max_side | letterbox, see ObjectDetectionProcessor.prepare_image
+        return self.get("BUILDING_DETECTION", "input_policy", fallback="fixed").strip().lower()
+
+    def get_bd_input_size(self) -> int:
+        return int(self.get("BUILDING_DETECTION", "input_size", fallback="3600"))
+
 
 
     # -- others ---
@@ -354,12 +400,36 @@ class Config:
         """
         return Path(resolve_path(self.get_paths_data()['map_index_path']))
 
+    def get_rate_limit_per_min(self) -> int:
+        """
+        Get the Street View request quota per minute shared by the scanner and the downloader
+        """
+        return int(self.get("Download", "rate_limit_per_min", fallback="30000"))
+
+    def get_tile_rate_limit_per_min(self) -> int:
+        """
+        Get the request quota per minute of the panorama tile endpoint (download_method = tiles)
+        """
+        return int(self.get("Download", "tile_rate_limit_per_min", fallback="30000"))
+
     def get_database_path(self) -> Path:
         """
         Get the path to the SQLite Database that stores all coordinates and panaroma IDs
         """
         return Path(resolve_path(self.get_paths_data()['metadata_database_path']))
 
+    def get_face_cache_path(self) -> Path:
+        """
+        Get the folder that caches raw Street View cube faces
+        """
+        return Path(resolve_path(self.get(section="Paths", option="face_cache_path", fallback="data\\face_cache")))
+
+    def get_gazetteer_path(self) -> Path:
+        """
+        Get the SQLite file holding city names and bounding boxes
+        """
+        return Path(resolve_path(self.get(section="Paths", option="gazetteer_path", fallback="data\\gazetteer.db")))
+
     def get_current_working_folder(self) -> Path:
         """
         Get the current folder path from the config.
@@ -0,0 +1,318 @@
+# Process-pool crop stage used by CropStreetWindow.ImageProcessorWorker
+# Usage:
+#   for index, result in run_crop_jobs(paths, save_folder, size_img, blur_region, face_paths, workers=4):
+#       ...   # result is the processed_metadata.json entry of paths[index]
+#
+# Kept free of Qt and of the app's Config/Logger so spawned workers (Windows) import only cv2 and PIL.
+
+import io
+import os
+import time
+import struct
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 'auto' picks per image: lossless DCT crop (jpegtran) > top-band decode > full decode
+CROP_METHODS = ("auto", "lossless", "partial", "full")
+JPEGTRAN = shutil.which("jpegtran")
+JPEG_QUALITY = 95  # cv2.imwrite's default, which crops were always saved with
+# PIL's decoder is slower than OpenCV's, so decoding only the top band stops paying off near the full height
+PARTIAL_DECODE_MAX_FRACTION = 0.9
+
+
+def _jpeg_header(path):
+    """
+    (width, height, MCU width, MCU height, progressive) from the JPEG header, or None for
+    other formats. Nothing is decoded.
+    """
+    try:
+        with Image.open(path) as im:
+            if im.format != "JPEG":
+                return None
+            h = max(layer[1] for layer in im.layer)
+            v = max(layer[2] for layer in im.layer)
+            return im.size[0], im.size[1], 8 * h, 8 * v, bool(im.info.get("progressive"))
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def _jpegtran_crop(src, dst, width, height, x, y) -> bool:
+    # lossless: copies the DCT blocks of the region, no decode and no generation loss
+    result = subprocess.run([JPEGTRAN, "-crop", f"{width}x{height}+{x}+{y}", "-copy", "none",
+                             "-outfile", dst, src], capture_output=True)
+    return result.returncode == 0 and os.path.exists(dst)
+
+
+def _sof_height_offset(data):
+    # byte offset of the frame height in a baseline/extended JPEG's SOF header, else None
+    i = 2
+    while i + 4 <= len(data) and data[i] == 0xFF:
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0xC0, 0xC1):
+            return i + 5
+        if marker == 0xDA or 0xC2 <= marker <= 0xCF:
+            return None  # progressive, lossless, arithmetic, or scan data before any frame
+        i += 2 + struct.unpack_from(">H", data, i + 2)[0]
+    return None
+
+
+def _decode_top_rows(path, rows):
+    """
+    PIL image of the first rows of a baseline JPEG. The frame height in an in-memory copy
+    of the file is cut to the band plus one row (so chroma upsampling at the band's bottom
+    edge matches a full decode); libjpeg then decodes only the band and skips the rest of
+    the scan. Decode errors raise as for any image; callers fall back to a full decode.
+    """
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    offset = _sof_height_offset(data)
+    if offset is None:
+        raise ValueError(f"{path} has no baseline frame header")
+    height = struct.unpack_from(">H", data, offset)[0]
+    struct.pack_into(">H", data, offset, min(rows + 1, height))
+    im = Image.open(io.BytesIO(data))
+    try:
+        im.load()
+    except Exception:
+        im.close()
+        raise
+    return im.crop((0, 0, im.size[0], rows)) if im.size[1] > rows else im
+
+
+def crop_file(image_path, save_folder, size_img, blur_region, whole=False, method="auto") -> dict:
+    """
+    Cut one image into the parts the detector sees and write them as JPEGs.
+    Panoramas lose the bottom blur_region rows (the car) and are split into left and right
+    halves; cube faces (whole=True) are written as they are.
+    method (see CROP_METHODS) chooses how: 'lossless' crops in the DCT domain with jpegtran
+    when it is installed and the right half starts on an MCU boundary (JPEG faces are simply
+    copied); 'partial' decodes only the kept band; 'full' decodes everything with OpenCV.
+    'auto' takes the first that applies, using 'partial' only for bands small enough to win.
+    Methods that do not apply fall back to a full decode.
+    """
+    src = str(image_path)
+    out = [os.path.join(str(save_folder), name + ".jpg") for name in crop_names(src, 1 if whole else 2)]
+    failed = {"source_file": src, "saved_files": [], "success": False}
+
+    header = _jpeg_header(src) if method != "full" else None
+    if header:
+        width, height, mcu_w, mcu_h, progressive = header
+        if whole and method in ("auto", "lossless"):
+            shutil.copyfile(src, out[0])
+            return {"source_file": src, "saved_files": out, "success": True}
+
+        x, y = min(size_img[0], width), min(size_img[1] - blur_region, height)
+        if not whole and (x <= 0 or y <= 0):
+            return failed
+        if not whole:
+            boxes = [(x // 2, y, 0, 0), (x - x // 2, y, x // 2, 0)]
+            if method in ("auto", "lossless") and JPEGTRAN and (x // 2) % mcu_w == 0:
+                if all(_jpegtran_crop(src, dst, *box) for dst, box in zip(out, boxes)):
+                    return {"source_file": src, "saved_files": out, "success": True}
+            if not progressive and (method == "partial" or
+                                    (method == "auto" and y <= PARTIAL_DECODE_MAX_FRACTION * height)):
+                try:
+                    band = _decode_top_rows(src, y)
+                    saved_files = []
+                    for dst, (w, h, left, top) in zip(out, boxes):
+                        band.crop((left, top, left + w, top + h)).save(dst, quality=JPEG_QUALITY)
+                        saved_files.append(dst)
+                    return {"source_file": src, "saved_files": saved_files, "success": True}
+                except Exception:
+                    pass  # full decode below
+
+    image = cv2.imread(src)
+    if image is None:
+        return failed
+
+    if whole:
+        images = [image]
+    else:
+        # same clamp as the JPEG paths, so the halves do not depend on the decoder
+        x, y = min(size_img[0], image.shape[1]), min(size_img[1] - blur_region, image.shape[0])
+        images = [image[0:y, 0:x//2], image[0:y, x//2:x]] if x > 0 and y > 0 else []
+
+    saved_files = []
+    for save_path, img in zip(out, images):
+        if cv2.imwrite(save_path, img):
+            saved_files.append(save_path)
+
+    return {
+        "source_file": src,
+        "saved_files": saved_files,
+        "success": bool(saved_files)
+    }
+
+
+def crop_arrays(image_path, size_img, blur_region, whole=False) -> list:
+    """
+    The parts crop_file would write, as RGB uint8 arrays in memory (the detector's
+    input), for the fused crop→detect mode. Baseline JPEG panoramas are decoded only down
+    to the kept band; OpenCV's BGR is converted where it has to do the decode.
+    Returns [] if the image cannot be read.
+    """
+    src = str(image_path)
+    header = _jpeg_header(src)
+    if header and not header[4]:
+        width, height = header[0], header[1]
+        if whole:
+            with Image.open(src) as im:
+                return [np.asarray(im.convert("RGB"))]
+        x, y = min(size_img[0], width), min(size_img[1] - blur_region, height)
+        if x <= 0 or y <= 0:
+            return []
+        try:
+            band = np.asarray(_decode_top_rows(src, y).convert("RGB"))
+            return [band[:, 0:x//2], band[:, x//2:x]]
+        except Exception:
+            pass  # full decode below
+
+    image = cv2.imread(src)
+    if image is None:
+        return []
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if whole:
+        return [image]
+    x, y = min(size_img[0], image.shape[1]), min(size_img[1] - blur_region, image.shape[0])
+    return [image[0:y, 0:x//2], image[0:y, x//2:x]] if x > 0 and y > 0 else []
+
+
+def crop_names(image_path, count) -> list:
+    # file stems of an image's parts, shared by written crops and in-memory ones
+    stem = os.path.splitext(os.path.basename(str(image_path)))[0]
+    return [f"{stem}_{(0, i)}" for i in range(count)]
+
+
+def save_crop_arrays(arrays, image_path, save_folder) -> list:
+    """
+    Write RGB parts from crop_arrays under the names crop_file uses (audit copies in fused mode).
+    """
+    saved_files = []
+    for name, part in zip(crop_names(image_path, len(arrays)), arrays):
+        save_path = os.path.join(str(save_folder), name + ".jpg")
+        Image.fromarray(part).save(save_path, quality=JPEG_QUALITY)
+        saved_files.append(save_path)
+    return saved_files
+
+
+def _crop_or_fail(path, save_folder, size_img, blur_region, whole, method) -> dict:
+    # one bad file (decode or save error, jpegtran) is a failed entry, not the end of the run
+    try:
+        return crop_file(path, save_folder, size_img, blur_region, whole, method)
+    except Exception as e:
+        return {"source_file": str(path), "saved_files": [], "success": False, "error": str(e)}
+
+
+def crop_chunk(jobs, save_folder, size_img, blur_region, method="auto") -> list:
+    # jobs: [(index, path, whole)], one pickled message per chunk instead of per image
+    return [(index, _crop_or_fail(path, save_folder, size_img, blur_region, whole, method)) for index, path, whole in jobs]
+
+
+def run_crop_jobs(paths, save_folder, size_img, blur_region, face_paths=(), workers=None, chunk_size=8, keep_going=None,
+                  method="auto"):
+    """
+    Crop every path, yielding (index into paths, result) as work finishes, in completion order.
+    With workers > 1 the paths are split into chunks of chunk_size and spread over a process
+    pool; at most 2 chunks per worker are in flight, so keep_going() (called before each
+    submission, may block while paused, returns False to cancel) takes effect quickly.
+    """
+    workers = workers or os.cpu_count() or 1
+    face_paths = {str(p) for p in face_paths}
+    jobs = [(i, str(p), str(p) in face_paths) for i, p in enumerate(paths)]
+
+    if workers <= 1:
+        for index, path, whole in jobs:
+            if keep_going and not keep_going():
+                return
+            yield index, _crop_or_fail(path, save_folder, size_img, blur_region, whole, method)
+        return
+
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            for chunk in chunks:
+                while len(pending) >= 2 * workers:
+                    done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+                if keep_going and not keep_going():
+                    return
+                pending.add(pool.submit(crop_chunk, chunk, str(save_folder), size_img, blur_region, method))
+            while pending:
+                done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def benchmark_crop(folder=None, worker_counts=(1, 2, 4, 8), n_images=48, chunk_size=4, size=(4096, 2048), blur_region=250):
+    """
+    Images per second and scaling efficiency (speedup / workers) of run_crop_jobs for each
+    worker count. Without a folder, n_images synthetic panoramas of the given size are used.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        if folder:
+            paths = sorted(p for p in (os.path.join(folder, f) for f in os.listdir(folder)) if p.lower().endswith((".jpg", ".jpeg", ".png")))
+            img = cv2.imread(paths[0])
+            size = (img.shape[1], img.shape[0])
+        else:
+            rng = np.random.default_rng(0)
+            noise = cv2.GaussianBlur(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8), (9, 9), 3)
+            paths = []
+            for i in range(n_images):
+                path = os.path.join(tmp, f"pano_{i}.jpg")
+                cv2.imwrite(path, np.roll(noise, i * 64, axis=1))
+                paths.append(path)
+
+        results = {}
+        for workers in worker_counts:
+            out = os.path.join(tmp, f"out_{workers}")
+            os.makedirs(out, exist_ok=True)
+            start = time.perf_counter()
+            done = sum(1 for _ in run_crop_jobs(paths, out, size, blur_region, workers=workers, chunk_size=chunk_size))
+            seconds = time.perf_counter() - start
+            results[workers] = done / seconds
+            speedup = results[workers] / results[worker_counts[0]] * worker_counts[0]
+            print(f"{workers} workers: {results[workers]:6.2f} img/s   speedup {speedup:4.2f}x   efficiency {speedup / workers:5.0%}")
+        return results
+
+
+def benchmark_crop_methods(size=(4096, 2048), blur_regions=(250, 1024), repeats=10):
+    """
+    ms per panorama of each crop method on one synthetic panorama, per blur region.
+    'lossless' only runs where jpegtran is installed.
+    """
+    import tempfile
+    rng = np.random.default_rng(0)
+    noise = cv2.GaussianBlur(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8), (9, 9), 3)
+    methods = [m for m in CROP_METHODS if m != "lossless" or JPEGTRAN]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pano.jpg")
+        cv2.imwrite(path, noise)
+        for blur_region in blur_regions:
+            for method in methods:
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    crop_file(path, tmp, size, blur_region, method=method)
+                results[(blur_region, method)] = (time.perf_counter() - start) / repeats * 1000
+                print(f"keep {size[1] - blur_region:5d} rows  {method:<9} {results[(blur_region, method)]:7.1f} ms/pano")
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark_crop_methods()
+    benchmark_crop(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,299 @@
+# Staged panorama download pipeline
+# Usage:
+#   pipeline = PanoramaPipeline(save_dir, logger=logger)
+#   pipeline.run(FOUND_COORDS, max_images=100, on_progress=lambda done, total, stats: ...)
+#
+# fetch (N threads, network bound) → reproject (process pool, CPU bound) → encode/write (1 thread)
+# Every hand-off is a bounded queue, so a slow stage stalls the ones before it instead of
+# piling up decoded faces in memory.
+
+import os
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from Tile_Downloader import (fetch_cube_faces_into, fetch_panorama_tiles, reproject_stacked, panorama_path,
+                             save_panorama, face_path, save_face_views, OUTPUT_MODE, OUTPUT_FACE_VIEWS,
+                             DOWNLOAD_METHOD, TILE_ZOOM, TILE_POOL_SIZE, TileSource, config)
+from metadata_db import DownloadManifest
+from faces_manifest import FacesManifestWriter
+
+_STOP = object()
+
+
+class StageStats:
+    """
+    Thread-safe done/failed counters per stage, reported as items per second since start.
+    """
+    STAGES = ("fetch", "reproject", "write")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.done = dict.fromkeys(self.STAGES, 0)
+        self.failed = 0
+
+    def mark(self, stage):
+        with self.lock:
+            self.done[stage] += 1
+
+    def mark_failed(self):
+        with self.lock:
+            self.failed += 1
+
+    def saved(self) -> int:
+        with self.lock:
+            return self.done["write"]
+
+    def summary(self) -> str:
+        with self.lock:
+            elapsed = max(time.monotonic() - self.start, 1e-6)
+            rates = " | ".join(f"{s} {self.done[s] / elapsed:.2f}/s" for s in self.STAGES)
+            return f"{rates} | failed {self.failed}"
+
+
+class PanoramaPipeline:
+    """
+    Downloads panoramas with the three stages overlapping.
+    download_workers panoramas are fetched at once (6 face requests each). Fetched faces
+    wait in a queue of the same size for the reprojection pool of reproject_processes
+    workers (0 runs it in threads instead), and finished panoramas are JPEG-encoded and
+    written in submission order by a single writer.
+    In output_mode 'faces' only the configured (heading, pitch) views are fetched and
+    written as they are, with a faces_manifest.jsonl for crop and detection; the
+    reprojection stage then sits idle. With download_method 'tiles' panoramas are
+    stitched from the tile grid at tile_zoom during the fetch and go straight to the writer.
+    With a db_path, progress is recorded in the downloads manifest: panoramas already
+    saved at this face size (and still on disk) are skipped, failed or interrupted ones
+    are retried.
+    """
+    def __init__(self, save_dir, face_size=None, download_workers=None, reproject_processes=None, logger=None, db_path=None,
+                 output_mode=None, face_views=None, download_method=None, tile_zoom=None):
+        download = config.get_download_data()
+        self.save_dir = save_dir
+        self.face_size = int(face_size or download['face_size'])
+        self.download_workers = int(download_workers or config.get("Download", "download_workers", fallback="4"))
+        if reproject_processes is None:
+            reproject_processes = int(config.get("Download", "reproject_processes", fallback="2"))
+        self.reproject_processes = reproject_processes
+        self.logger = logger
+        self.db_path = db_path
+        self.output_mode = output_mode or OUTPUT_MODE
+        self.face_views = face_views or OUTPUT_FACE_VIEWS
+        self.download_method = download_method or DOWNLOAD_METHOD
+        self.tile_zoom = TILE_ZOOM if tile_zoom is None else tile_zoom
+        if self.download_method == "tiles":
+            # the cube face size with the same output resolution, so the manifest notices zoom changes
+            source = TileSource()
+            self.face_size = source.grid(self.tile_zoom)[1] * source.tile_size // 2
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, coords, max_images=None, on_progress=None) -> int:
+        """
+        Download every (lat, lng, pano_id) in coords, stopping after max_images successes.
+        on_progress(done, total, stage_summary) is called after every finished panorama.
+        Returns the number of panoramas saved. An error that stops the feed (e.g. the
+        manifest failing) is raised once the panoramas already queued are written.
+        """
+        manifest = DownloadManifest(self.db_path) if self.db_path else None
+        try:
+            return self._run(coords, max_images, on_progress, manifest)
+        finally:
+            if manifest:
+                manifest.close()
+
+    def pending(self, coords, manifest) -> list:
+        """
+        coords minus the panoramas the manifest says are done and whose file is intact.
+        """
+        self._remove_partial_files()
+        if manifest is None:
+            return list(coords)
+        completed = manifest.completed(self.face_size)
+        todo = []
+        for lat, lng, pano_id in coords:
+            entry = completed.get(pano_id)
+            path = self.output_path(pano_id, (lat, lng))
+            if entry and entry[0] == path and os.path.exists(path) and os.path.getsize(path) == entry[1]:
+                continue
+            todo.append((lat, lng, pano_id))
+        return todo
+
+    def output_path(self, pano_id, coords) -> str:
+        """
+        The file the manifest tracks for a panorama: the panorama itself, or its first face.
+        """
+        if self.output_mode == "faces":
+            heading, pitch = self.face_views[0]
+            return face_path(self.save_dir, pano_id, coords, heading, pitch)
+        return panorama_path(self.save_dir, pano_id, coords)
+
+    def _remove_partial_files(self):
+        # temp files of writes a crash interrupted; the manifest still has them as pending
+        if not os.path.isdir(self.save_dir):
+            return
+        for name in os.listdir(self.save_dir):
+            if name.endswith(".jpg.tmp"):
+                os.remove(os.path.join(self.save_dir, name))
+
+    def _run(self, coords, max_images, on_progress, manifest) -> int:
+        todo = self.pending(coords, manifest)
+        if len(todo) < len(coords):
+            self._log_status(f"Skipping {len(coords) - len(todo)} panoramas already downloaded")
+        coords = todo
+        total = min(len(coords), max_images) if max_images else len(coords)
+        stats = StageStats()
+        fetch_q = queue.Queue(maxsize=self.download_workers)
+        cpu_q = queue.Queue(maxsize=self.download_workers)
+        write_q = queue.Queue(maxsize=max(1, self.reproject_processes) * 2)
+
+        # one slot per panorama that may still end up saved; failures hand theirs back
+        slots = threading.Semaphore(total)
+
+        def take_slot() -> bool:
+            while not slots.acquire(timeout=0.2):
+                if self.stop_event.is_set() or stats.saved() >= total:
+                    return False
+            return not self.stop_event.is_set()
+
+        feed_errors = []
+
+        def feed():
+            try:
+                for lat, lng, pano_id in coords:
+                    if not take_slot():
+                        break
+                    if manifest:
+                        manifest.mark_pending(pano_id, self.output_path(pano_id, (lat, lng)), self.face_size)
+                    fetch_q.put((lat, lng, pano_id))
+            except Exception as e:  # e.g. a locked manifest; the stages below still have to wind down
+                feed_errors.append(e)
+            finally:
+                for _ in range(self.download_workers):
+                    fetch_q.put(_STOP)
+
+        def fetch():
+            while True:
+                job = fetch_q.get()
+                if job is _STOP:
+                    return
+                lat, lng, pano_id = job
+                if self.output_mode == "faces":
+                    save_faces(lat, lng, pano_id)
+                    continue
+                try:
+                    if self.download_method == "tiles":
+                        # download_workers panoramas at once share the tile session's pool
+                        eq = fetch_panorama_tiles(pano_id, self.tile_zoom, logger=self.logger,
+                                                  workers=max(1, TILE_POOL_SIZE // self.download_workers))
+                    else:
+                        buf = fetch_cube_faces_into(pano_id, logger=self.logger, FACE_SIZE=self.face_size)
+                except Exception as e:
+                    self._log_exception(f"Failed to fetch {pano_id} at ({lat},{lng}): {e}")
+                    failed(pano_id, e)
+                    continue
+                stats.mark("fetch")
+                if self.download_method == "tiles":
+                    # already equirectangular: skip the process pool
+                    stitched = Future()
+                    stitched.set_result(eq)
+                    write_q.put((job, stitched))
+                else:
+                    cpu_q.put((job, buf))
+
+        def save_faces(lat, lng, pano_id):
+            try:
+                entries = save_face_views(pano_id, self.save_dir, (lat, lng), self.face_views,
+                                          self.face_size, self.logger)
+            except Exception as e:
+                self._log_exception(f"Failed to fetch faces of {pano_id} at ({lat},{lng}): {e}")
+                failed(pano_id, e)
+                return
+            stats.mark("fetch")
+            for entry in entries:
+                faces_manifest.add({k: v for k, v in entry.items() if k not in ("bytes", "sha256")})
+            if manifest:
+                checksum = hashlib.sha256("".join(e["sha256"] for e in entries).encode()).hexdigest()
+                path = os.path.join(self.save_dir, entries[0]["file"])
+                manifest.mark_done(pano_id, path, entries[0]["bytes"], checksum, self.face_size)
+            stats.mark("write")
+            progress()
+
+        def dispatch(pool):
+            while True:
+                item = cpu_q.get()
+                if item is _STOP:
+                    write_q.put(_STOP)
+                    return
+                job, buf = item
+                write_q.put((job, pool.submit(reproject_stacked, buf, self.face_size)))
+
+        def write():
+            while True:
+                item = write_q.get()
+                if item is _STOP:
+                    return
+                (lat, lng, pano_id), future = item
+                try:
+                    eq = future.result()
+                    stats.mark("reproject")
+                    path = panorama_path(self.save_dir, pano_id, (lat, lng))
+                    size, checksum = save_panorama(eq, path)
+                except Exception as e:
+                    self._log_exception(f"Failed to reproject/save {pano_id} at ({lat},{lng}): {e}")
+                    failed(pano_id, e)
+                    continue
+                if manifest:
+                    manifest.mark_done(pano_id, path, size, checksum, self.face_size)
+                stats.mark("write")
+                progress()
+
+        def failed(pano_id, error):
+            if manifest:
+                manifest.mark_failed(pano_id, error)
+            stats.mark_failed()
+            slots.release()
+            progress()
+
+        def progress():
+            if on_progress:
+                on_progress(stats.saved(), total, stats.summary())
+
+        os.makedirs(self.save_dir, exist_ok=True)
+        faces_manifest = FacesManifestWriter(self.save_dir)
+        if self.reproject_processes > 0 and self.output_mode != "faces" and self.download_method != "tiles":
+            pool = ProcessPoolExecutor(max_workers=self.reproject_processes)
+        else:
+            pool = ThreadPoolExecutor(max_workers=2)
+
+        with pool:
+            threads = [threading.Thread(target=feed, daemon=True)]
+            threads += [threading.Thread(target=fetch, daemon=True) for _ in range(self.download_workers)]
+            dispatcher = threading.Thread(target=dispatch, args=(pool,), daemon=True)
+            writer = threading.Thread(target=write, daemon=True)
+            for t in threads + [dispatcher, writer]:
+                t.start()
+            for t in threads:
+                t.join()
+            cpu_q.put(_STOP)  # every fetcher is done
+            dispatcher.join()
+            writer.join()
+
+        if feed_errors:
+            self._log_exception(f"Pipeline stopped feeding after {stats.saved()} saved: {feed_errors[0]}")
+            raise feed_errors[0]
+        self._log_status(f"Pipeline finished: {stats.saved()} saved, {stats.summary()}")
+        return stats.saved()
+
+    def _log_status(self, msg):
+        if self.logger:
+            self.logger.log_status(msg)
+
+    def _log_exception(self, msg):
+        if self.logger:
+            self.logger.log_exception(msg)
@@ -0,0 +1,92 @@
+# On-disk cache of raw Street View cube faces
+# Usage:
+#   cache = FaceCache('data/face_cache', max_bytes=2 * 1024**3)
+#   data = cache.get(pano_id, heading, pitch, size)      # JPEG bytes or None
+#   cache.put(pano_id, heading, pitch, size, data)
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class FaceCache:
+    """
+    Stores the Static API's JPEG bytes under a hash of (pano_id, heading, pitch, size),
+    so changes to orientation or projection code can be re-run without the network.
+    Least recently used faces are evicted once the cache grows past max_bytes.
+    Recency survives restarts through file modification times.
+    """
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> size, least recently used first
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".jpg"):
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.path, st.st_size))
+        for _, path, size in sorted(found):
+            self.entries[path] = size
+            self.total += size
+
+    def path_for(self, pano_id, heading, pitch, size) -> str:
+        digest = hashlib.sha1(f"{pano_id}|{heading}|{pitch}|{size}".encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + ".jpg")
+
+    def get(self, pano_id, heading, pitch, size):
+        path = self.path_for(pano_id, heading, pitch, size)
+        with self.lock:
+            if path not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # removed behind our back (or evicted by another thread meanwhile)
+            with self.lock:
+                self.total -= self.entries.pop(path, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, pano_id, heading, pitch, size, data: bytes):
+        path = self.path_for(pano_id, heading, pitch, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(path, 0)
+            self.entries[path] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            path, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "files": len(self.entries), "bytes": self.total}
@@ -0,0 +1,55 @@
+# Manifest of cube-face images, written next to them as faces_manifest.jsonl
+# One JSON object per line: {"file", "pano_id", "lat", "lng", "heading", "pitch", "size"}
+# Written by the downloader in 'faces' output mode and by the crop step; read by crop and detection
+# so faces are used as they are instead of being treated as equirectangular panoramas.
+
+import json
+import threading
+from pathlib import Path
+
+MANIFEST_NAME = "faces_manifest.jsonl"
+
+
+def read_faces_manifest(folder) -> list[dict] | None:
+    """
+    Entries of the folder's manifest whose file still exists, with an absolute 'path' added.
+    Returns None when the folder has no manifest.
+    """
+    folder = Path(folder)
+    manifest = folder / MANIFEST_NAME
+    if not manifest.exists():
+        return None
+
+    entries = {}
+    with open(manifest, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            entries[entry["file"]] = entry  # re-downloads append; the last line wins
+
+    result = []
+    for entry in entries.values():
+        path = folder / entry["file"]
+        if path.exists():
+            result.append({**entry, "path": path})
+    return result
+
+
+class FacesManifestWriter:
+    """
+    Appends entries to a folder's manifest; safe to share between threads.
+    """
+    def __init__(self, folder):
+        self.path = Path(folder) / MANIFEST_NAME
+        self.lock = threading.Lock()
+
+    def add(self, entry: dict):
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
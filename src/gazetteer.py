@@ -0,0 +1,108 @@
+# Local index of city names and bounding boxes, so city selection does not need the network
+# Usage:
+#   gaz = Gazetteer(config.get_gazetteer_path())
+#   gaz.sync(resolve_path("cities.txt"), config.get_map_index_path())   # cheap when nothing changed
+#   gaz.names()                         # every city, sorted
+#   gaz.bounds("Aizawl")                # {"north", "south", "east", "west"} or None
+#   gaz.lookup("Kohima", fetch=fetch_city_bounds)   # local first, fetch() only on a miss, answer cached
+
+import os
+import json
+import sqlite3
+import threading
+
+
+class Gazetteer:
+    """
+    SQLite table of cities keyed by lower-case name, looked up through its primary key
+    index. Names come from cities.txt, bounds from index_map.json and
+    from earlier online lookups (source 'nominatim'), which are kept across re-syncs.
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS cities (
+                    key TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    north REAL, south REAL, east REAL, west REAL,
+                    source TEXT
+                ) WITHOUT ROWID""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def sync(self, cities_path=None, index_path=None) -> bool:
+        """
+        Load names from cities_path and bounds from index_path (index_map.json) if either
+        file changed since the last sync. Returns True if anything was reloaded.
+        """
+        stamp = json.dumps([self._mtime(cities_path), self._mtime(index_path)])
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key='sources'").fetchone()
+        if row and row[0] == stamp:
+            return False
+
+        rows = {}
+        if cities_path and os.path.exists(cities_path):
+            with open(cities_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    name = line.strip()
+                    if name:
+                        rows[name.lower()] = (name.lower(), name, None, None, None, None, None)
+        if index_path and os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for key, b in json.load(f).items():
+                    name = rows[key.lower()][1] if key.lower() in rows else key.title()
+                    rows[key.lower()] = (key.lower(), name, b["north"], b["south"], b["east"], b["west"], "index_map")
+
+        with self.lock, self.conn:
+            # names and shipped bounds are replaced; bounds fetched online survive unless the index has the city
+            self.conn.executemany("""
+                INSERT INTO cities (key, name, north, south, east, west, source) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    name=excluded.name,
+                    north=COALESCE(excluded.north, cities.north), south=COALESCE(excluded.south, cities.south),
+                    east=COALESCE(excluded.east, cities.east), west=COALESCE(excluded.west, cities.west),
+                    source=COALESCE(excluded.source, cities.source)""", list(rows.values()))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sources', ?)", (stamp,))
+        return True
+
+    @staticmethod
+    def _mtime(path):
+        return os.path.getmtime(path) if path and os.path.exists(path) else None
+
+    def names(self) -> list[str]:
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT name FROM cities ORDER BY key")]
+
+    def bounds(self, city: str) -> dict | None:
+        with self.lock:
+            row = self.conn.execute("SELECT north, south, east, west FROM cities WHERE key=?",
+                                    (city.strip().lower(),)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return dict(zip(("north", "south", "east", "west"), row))
+
+    def put(self, city: str, bounds: dict, source="nominatim"):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO cities (key, name, north, south, east, west, source) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET north=excluded.north, south=excluded.south,
+                    east=excluded.east, west=excluded.west, source=excluded.source""",
+                (city.strip().lower(), city.strip(), bounds["north"], bounds["south"], bounds["east"], bounds["west"], source))
+
+    def lookup(self, city: str, fetch=None) -> dict | None:
+        """
+        Bounds of city from the index; on a miss, fetch(city) (e.g. Nominatim) is called
+        if given and a non-empty answer is stored for next time.
+        """
+        bounds = self.bounds(city)
+        if bounds is None and fetch is not None:
+            bounds = fetch(city)
+            if bounds:
+                self.put(city, bounds)
+        return bounds
+
+    def close(self):
+        self.conn.close()
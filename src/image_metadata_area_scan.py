@@ -15,6 +15,7 @@ class StreetViewScanner(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Street View Area Scanner")
+        self.session = requests.Session()  # reuse one keep-alive connection across lookups
         self.initUI()
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_ui)
@@ -106,7 +107,7 @@ class StreetViewScanner(QWidget):
         retry=retry_if_exception(retry_if_5xx_error)
     )
     def safe_get(self, url, params = None):
-        return requests.get(url=url, params=params)
+        return self.session.get(url=url, params=params, timeout=10)
 
 
     def scan_area(self):
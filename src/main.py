@@ -1,4 +1,5 @@
 import sys, time, os
+import multiprocessing
 sys.path.append(os.path.dirname(__file__))
 
 from PyQt5.QtWidgets import (
@@ -12,35 +13,42 @@ from utils import resolve_path
 
 ## We need to download PyQT and PyQt5.QtWebEngineWidgets seperately
 
-# --- Setup Logging ---
 from AppLogger import Logger
-logger = Logger(__name__)
-logger.log_status("Starting App")
-
-# --- Configuration ---
 from config_ import Config  # Custom config module
-config = Config(logger, resolve_path("config_.ini"))
-logger.log_status(resolve_path("config_.ini"))
+
+# Windows starts process-pool workers (crop stage, reprojection) by re-importing this file
+# as __mp_main__: everything heavy (tensorflow via the windows) and every side effect stays
+# below, so workers only pay for Qt and the config module.
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    # --- Setup Logging ---
+    logger = Logger(__name__)
+    logger.log_status("Starting App")
+
+    # --- Configuration ---
+    config = Config(logger, resolve_path("config_.ini"))
+    logger.log_status(resolve_path("config_.ini"))
 
 
-# --- Check if map index exists ---
-if not config.get_map_index_path().exists():
-    import map_index_maker
-    map_index_maker.create_index()
+    # --- Check if map index exists ---
+    if not config.get_map_index_path().exists():
+        import map_index_maker
+        map_index_maker.create_index()
 
-### Create a pop-up that allows you to select which models you want to download.
+    ### Create a pop-up that allows you to select which models you want to download.
 
-# --- Import refactored Qt versions of feature windows ---
-a = time.time()
-from ApiWindow import ApiWindow
-from CropStreetWindow import CropWindow 
-from BuildingDetectionWindow import BuildingDetectionWindow
-from Classification import ClassificationWindow
-from Duplicates_Better import DuplicatesWindow
-from model_training import Trainer
-logger.log_status(f'Time taken to import modules: {time.time()-a}.')
+    # --- Import refactored Qt versions of feature windows ---
+    a = time.time()
+    from ApiWindow import ApiWindow
+    from CropStreetWindow import CropWindow
+    from BuildingDetectionWindow import BuildingDetectionWindow
+    from Classification import ClassificationWindow
+    from Duplicates_Better import DuplicatesWindow
+    from model_training import Trainer
+    logger.log_status(f'Time taken to import modules: {time.time()-a}.')
 
-logger.log_status('Modules imported. Starting Main App')
+    logger.log_status('Modules imported. Starting Main App')
 
 
 class OverlaySidebar(QWidget):
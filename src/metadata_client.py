@@ -0,0 +1,85 @@
+# Async Street View metadata client
+# Usage:
+#   async with AsyncMetadataClient(api_key, max_concurrency=50) as client:
+#       data = await client.fetch(lat, lon)
+
+import asyncio
+import aiohttp
+from tenacity import retry, retry_if_exception, wait_exponential, stop_after_attempt
+from rate_limiter import RateLimitedError
+
+METADATA_URL = "https://maps.googleapis.com/maps/api/streetview/metadata"
+
+
+def retry_if_transient_error(exception):
+    """Return True for connection errors, timeouts, throttling and 5xx responses."""
+    if isinstance(exception, aiohttp.ClientResponseError):
+        return 500 <= exception.status < 600
+    return isinstance(exception, (aiohttp.ClientError, asyncio.TimeoutError, RateLimitedError))
+
+
+class AsyncMetadataClient:
+    """
+    Metadata client on one pooled aiohttp session.
+    TCP/TLS connections are kept alive and reused across lookups, and a semaphore
+    caps the number of requests waiting on the network at max_concurrency.
+    base_url can point at a local stub that serves /streetview/metadata JSON.
+    If a rate_limiter (rate_limiter.TokenBucket) is given, every attempt waits on it
+    and reports 429 / OVER_QUERY_LIMIT back to it.
+    """
+    def __init__(self, api_key, max_concurrency=20, base_url=METADATA_URL, timeout=10, rate_limiter=None):
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @retry(
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        stop=stop_after_attempt(3),
+        retry=retry_if_exception(retry_if_transient_error)
+    )
+    async def fetch(self, lat, lon) -> dict:
+        """
+        Returns the metadata JSON for one location.
+        """
+        params = {"location": f"{lat},{lon}", "key": self.api_key}
+        if self.rate_limiter:
+            await self.rate_limiter.acquire_async()
+        async with self.semaphore:
+            async with self.session.get(self.base_url, params=params) as resp:
+                if resp.status == 429:
+                    self._throttled()
+                    raise RateLimitedError(f"HTTP 429 for {lat},{lon}")
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+
+        if data.get("status") == "OVER_QUERY_LIMIT":
+            self._throttled()
+            raise RateLimitedError(f"OVER_QUERY_LIMIT for {lat},{lon}")
+        if self.rate_limiter:
+            self.rate_limiter.on_success()
+        return data
+
+    def _throttled(self):
+        if self.rate_limiter:
+            self.rate_limiter.on_throttled()
@@ -0,0 +1,272 @@
+import math
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def ensure_schema(conn: sqlite3.Connection):
+    """
+    Create the scan tables and indexes if they are missing and migrate older databases.
+    Safe to call on every open.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS coords (
+            id INTEGER PRIMARY KEY,
+            lat REAL, lon REAL,
+            stage TEXT, scanned INTEGER DEFAULT 0,
+            depth INTEGER DEFAULT 0
+        )""")
+
+    # Refinement depth (0 = seed lattice) lets quadtree scans resume; older DBs only had fine children at depth 1
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(coords)")]
+    if "depth" not in columns:
+        cur.execute("ALTER TABLE coords ADD COLUMN depth INTEGER DEFAULT 0")
+        cur.execute("UPDATE coords SET depth=1 WHERE stage='fine'")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS results (
+            coord_id INTEGER, pano_id TEXT,
+            FOREIGN KEY(coord_id) REFERENCES coords(id)
+        )""")
+
+    #### Temporary table that stores the http responses recieved when querying for metadata. Making ths as I was getting
+    #### no "OK" responses
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            coord_id INTEGER, response TEXT
+        )""")
+
+    # One row per panorama: its own location and the first grid point that found it
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS panoramas (
+            id INTEGER PRIMARY KEY,
+            pano_id TEXT UNIQUE NOT NULL,
+            lat REAL, lng REAL,
+            coord_id INTEGER,
+            FOREIGN KEY(coord_id) REFERENCES coords(id)
+        )""")
+
+    # Download manifest: one row per panorama the downloader has attempted.
+    # status is 'pending' while in flight (left behind by a crash), then 'done' or 'failed'
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS downloads (
+            pano_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            path TEXT,
+            bytes INTEGER,
+            checksum TEXT,
+            face_size INTEGER,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            updated_at REAL
+        )""")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_results_pano_id ON results(pano_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_coords_lat_lon ON coords(lat, lon)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_panoramas_lat_lng ON panoramas(lat, lng)")
+
+    # R*Tree over found panoramas, kept in sync by triggers. Builds without the
+    # rtree module fall back to the (lat, lng) index in the selection queries.
+    try:
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS panorama_rtree
+            USING rtree(id, min_lat, max_lat, min_lng, max_lng)""")
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS panoramas_rtree_insert AFTER INSERT ON panoramas
+            WHEN new.lat IS NOT NULL AND new.lng IS NOT NULL
+            BEGIN
+                INSERT INTO panorama_rtree VALUES (new.id, new.lat, new.lat, new.lng, new.lng);
+            END""")
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS panoramas_rtree_delete AFTER DELETE ON panoramas
+            BEGIN
+                DELETE FROM panorama_rtree WHERE id = old.id;
+            END""")
+    except sqlite3.OperationalError:
+        pass
+
+    # Databases scanned before the panoramas table existed: the pano's own location
+    # was not stored, so the finding grid point stands in for it
+    cur.execute("SELECT EXISTS(SELECT 1 FROM panoramas)")
+    if not cur.fetchone()[0]:
+        cur.execute("""
+            INSERT OR IGNORE INTO panoramas(pano_id, lat, lng, coord_id)
+            SELECT r.pano_id, c.lat, c.lon, r.coord_id
+            FROM results r JOIN coords c ON c.id = r.coord_id
+            WHERE r.pano_id IS NOT NULL
+            ORDER BY r.rowid
+        """)
+
+    if has_rtree(conn):
+        cur.execute("SELECT EXISTS(SELECT 1 FROM panorama_rtree)")
+        if not cur.fetchone()[0]:
+            cur.execute("""
+                INSERT INTO panorama_rtree
+                SELECT id, lat, lat, lng, lng FROM panoramas
+                WHERE lat IS NOT NULL AND lng IS NOT NULL
+            """)
+
+    conn.commit()
+
+
+def connect(db_path) -> sqlite3.Connection:
+    """
+    Open the metadata database with the schema in place.
+    """
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    return conn
+
+
+def connect_readonly(db_path) -> sqlite3.Connection:
+    """
+    Open an existing metadata database for queries only: no schema checks or migrations,
+    which connect() (run at startup and by the scanner) has already done.
+    """
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+def scan_efficiency(conn: sqlite3.Connection) -> list[tuple[str, int, int]]:
+    """
+    (stage, API calls made, unique panoramas first found) per scan stage, to compare strategies.
+    """
+    query = """
+        SELECT c.stage, COUNT(*), COUNT(p.id)
+        FROM coords c LEFT JOIN panoramas p ON p.coord_id = c.id
+        WHERE c.scanned = 1
+        GROUP BY c.stage
+    """
+    return conn.execute(query).fetchall()
+
+
+def has_rtree(conn: sqlite3.Connection) -> bool:
+    cur = conn.execute("SELECT 1 FROM sqlite_master WHERE name='panorama_rtree'")
+    return cur.fetchone() is not None
+
+
+# --- spatial selection ---
+
+def panoramas_in_bbox(conn: sqlite3.Connection, north, south, east, west) -> list[tuple[float, float, str]]:
+    """
+    (lat, lng, pano_id) of every panorama inside the box, answered from the R*Tree.
+    """
+    if has_rtree(conn):
+        query = """
+            SELECT p.lat, p.lng, p.pano_id
+            FROM panorama_rtree t JOIN panoramas p ON p.id = t.id
+            WHERE t.min_lat <= ? AND t.max_lat >= ? AND t.min_lng <= ? AND t.max_lng >= ?
+        """
+    else:
+        query = """
+            SELECT p.lat, p.lng, p.pano_id
+            FROM panoramas p
+            WHERE p.lat <= ? AND p.lat >= ? AND p.lng <= ? AND p.lng >= ?
+        """
+    return conn.execute(query, (north, south, east, west)).fetchall()
+
+
+def haversine_m(lat1, lng1, lat2, lng2) -> float:
+    """
+    Great-circle distance in metres.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def panoramas_in_circle(conn: sqlite3.Connection, lat, lng, radius_m) -> list[tuple[float, float, str]]:
+    """
+    Bounding-box prefilter on the index, then an exact haversine distance test.
+    """
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    candidates = panoramas_in_bbox(conn, lat + dlat, lat - dlat, lng + dlng, lng - dlng)
+    return [row for row in candidates if haversine_m(lat, lng, row[0], row[1]) <= radius_m]
+
+
+def point_in_polygon(lat, lng, polygon) -> bool:
+    """
+    Ray casting test; polygon is a list of (lat, lng) vertices, open or closed.
+    """
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lng_i = polygon[i]
+        lat_j, lng_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            cross_lng = lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i)
+            if lng < cross_lng:
+                inside = not inside
+        j = i
+    return inside
+
+
+def panoramas_in_polygon(conn: sqlite3.Connection, polygon) -> list[tuple[float, float, str]]:
+    """
+    Bounding-box prefilter on the index, then an exact point-in-polygon test.
+    """
+    lats = [float(p[0]) for p in polygon]
+    lngs = [float(p[1]) for p in polygon]
+    polygon = list(zip(lats, lngs))
+    candidates = panoramas_in_bbox(conn, max(lats), min(lats), max(lngs), min(lngs))
+    return [row for row in candidates if point_in_polygon(row[0], row[1], polygon)]
+
+
+# --- download manifest ---
+
+class DownloadManifest:
+    """
+    Thread-safe access to the downloads table for the download pipeline.
+    Every update is committed at once so an interrupted run can be resumed.
+    """
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        ensure_schema(self.conn)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def completed(self, face_size) -> dict[str, tuple[str, int]]:
+        """
+        {pano_id: (path, bytes)} of panoramas already saved at this face size.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT pano_id, path, bytes FROM downloads WHERE status='done' AND face_size=?",
+                (int(face_size),)).fetchall()
+        return {pano_id: (path, size) for pano_id, path, size in rows}
+
+    def _upsert(self, pano_id, status, path=None, size=None, checksum=None, face_size=None, error=None, attempt=0):
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO downloads(pano_id, status, path, bytes, checksum, face_size, attempts, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(pano_id) DO UPDATE SET
+                    status=excluded.status,
+                    path=COALESCE(excluded.path, path),
+                    bytes=excluded.bytes,
+                    checksum=excluded.checksum,
+                    face_size=COALESCE(excluded.face_size, face_size),
+                    attempts=attempts + excluded.attempts,
+                    error=excluded.error,
+                    updated_at=excluded.updated_at
+            """, (pano_id, status, path, size, checksum, face_size, attempt, error, time.time()))
+            self.conn.commit()
+
+    def mark_pending(self, pano_id, path, face_size):
+        self._upsert(pano_id, "pending", path=path, face_size=face_size, attempt=1)
+
+    def mark_done(self, pano_id, path, size, checksum, face_size):
+        self._upsert(pano_id, "done", path=path, size=size, checksum=checksum, face_size=face_size)
+
+    def mark_failed(self, pano_id, error):
+        self._upsert(pano_id, "failed", error=str(error)[:500])
@@ -1,65 +1,490 @@
 import os
-import requests
+import io
+import json
+import time
+import shutil
+import hashlib
 import tarfile
+import tempfile
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from config_ import Config
 from AppLogger import Logger
 from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
-from requests.exceptions import Timeout, HTTPError
+from requests.exceptions import Timeout, HTTPError, ChunkedEncodingError
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from rate_limiter import get_rate_limiter
+
+DOWNLOAD_CONNECTIONS = 4
+
+# Model hosts throttle separately from Street View, so they get their own bucket. The
+# burst lets the probe and every connection's first Range request go out at once instead
+# of one per second; each later request follows a whole chunk, far below the rate.
+DOWNLOAD_RATE_PER_MIN = 60
+rate_limiter = get_rate_limiter("model_download", DOWNLOAD_RATE_PER_MIN, burst=DOWNLOAD_CONNECTIONS + 1)
+
+RANGE_CHUNK_SIZE = 16 * 1024 * 1024   # bytes per Range request
+WRITE_BUFFER_SIZE = 1024 * 1024       # bytes per read from the socket / write to disk
 
 def retry_if_transient_error(exception):
     """Retry for all network level errors"""
     return (
-        isinstance(exception, (ConnectionError, Timeout)) or
-        (isinstance(exception, HTTPError) and exception.response is not None and 500 <= exception.response.status_code < 600)
+        isinstance(exception, (ConnectionError, RequestsConnectionError, ChunkedEncodingError, Timeout)) or
+        (isinstance(exception, HTTPError) and exception.response is not None and
+         (500 <= exception.response.status_code < 600 or exception.response.status_code == 429))
     )
-    
+
 
 @retry(
         wait=wait_exponential(multiplier=1, min=2, max=10),
         stop=stop_after_attempt(3),
         retry=retry_if_exception(retry_if_transient_error)
 )
-def safe_get(url, stream = True):
-    return requests.get(url=url, stream=stream)
+def safe_get(url, stream = True, headers=None, session=None):
+    rate_limiter.acquire()
+    response = (session or requests).get(url=url, stream=stream, headers=headers, timeout=30)
+    if response.status_code == 429:
+        rate_limiter.on_throttled()
+        response.raise_for_status()
+    if response.status_code >= 500:
+        response.raise_for_status()
+    rate_limiter.on_success()
+    return response
 
-def is_safe(member, target_dir):
-    abs_target = os.path.abspath(target_dir)
-    abs_member = os.path.abspath(os.path.join(target_dir, member.name))
-    return abs_member.startswith(abs_target)
 
-def download_model(logger: Logger, config: Config, model_name = 'faster_rcnn'):
+class RangeDownload:
+    """
+    Downloads url to path over several connections with HTTP Range requests.
+    The file is written as path + '.part' with a '.part.json' sidecar listing finished
+    chunks, so an interrupted download resumes where it stopped. Servers without Range
+    support get one streamed connection.
+    prefix() / wait_for() expose how many leading bytes are already on disk, so the file
+    can be consumed (extracted) while it is still downloading.
+    """
+    def __init__(self, url, path, connections=DOWNLOAD_CONNECTIONS, chunk_size=RANGE_CHUNK_SIZE, logger=None):
+        self.url = url
+        self.path = path
+        self.part_path = path + ".part"
+        self.state_path = self.part_path + ".json"
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.logger = logger
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=connections))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=connections))
+
+        self.cond = threading.Condition()
+        self.total = None           # bytes, None if the server does not say
+        self.chunks = []            # (start, end) inclusive byte ranges
+        self.written = []           # bytes on disk per chunk
+        self.finished = False
+        self.error = None
+        self.thread = None
+
+    # --- consumer side ---
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def join(self):
+        """
+        Waits for the download and moves the finished '.part' into place. Call it after
+        readers of the '.part' are closed (Windows cannot rename an open file).
+        """
+        self.thread.join()
+        if self.error:
+            raise self.error
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def prefix(self) -> int:
+        with self.cond:
+            return self._prefix()
+
+    def _prefix(self) -> int:
+        done = 0
+        for (start, end), written in zip(self.chunks, self.written):
+            done += written
+            if written < end - start + 1:
+                break
+        return done
+
+    def wait_for(self, offset) -> int:
+        """
+        Blocks until at least offset leading bytes are on disk (or the download ended)
+        and returns the current prefix length. Re-raises a download failure.
+        """
+        with self.cond:
+            while True:
+                if self.error:
+                    raise self.error
+                available = self._prefix()
+                if available >= offset or self.finished:
+                    return available
+                self.cond.wait(timeout=1.0)
+
+    # --- download side ---
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.log_status(msg)
+
+    def _probe(self):
+        """
+        Ask for the first byte: a 206 with Content-Range gives the size and proves Range
+        support. Also follows redirects once, so chunks go straight to the final host.
+        """
+        resp = safe_get(self.url, stream=True, headers={"Range": "bytes=0-0"}, session=self.session)
+        resp.raise_for_status()
+        self.url = resp.url
+        etag = resp.headers.get("ETag")
+        if resp.status_code == 206 and "/" in resp.headers.get("Content-Range", ""):
+            total = resp.headers["Content-Range"].rsplit("/", 1)[1]
+            resp.close()
+            return (int(total) if total != "*" else None), True, etag
+        length = resp.headers.get("Content-Length")
+        resp.close()
+        return (int(length) if length else None), False, etag
+
+    def _load_state(self, total, etag) -> set:
+        # finished chunks of an earlier attempt at the same file
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        same_file = (state.get("total") == total and state.get("etag") == etag
+                     and state.get("chunk_size") == self.chunk_size)
+        if not same_file or not os.path.exists(self.part_path) or os.path.getsize(self.part_path) != total:
+            return set()
+        return set(state.get("done", []))
+
+    def _save_state(self, etag, done):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "total": self.total, "etag": etag,
+                       "chunk_size": self.chunk_size, "done": sorted(done)}, f)
+        os.replace(tmp, self.state_path)
+
+    def _run(self):
+        try:
+            total, ranges, etag = self._probe()
+            if not ranges or total is None:
+                self._log("Server does not support Range requests, downloading on one connection")
+                self._run_single(total)
+            else:
+                self._run_ranges(total, etag)
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+            return
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def _run_ranges(self, total, etag):
+        done = self._load_state(total, etag)
+        with self.cond:
+            self.total = total
+            self.chunks = [(start, min(start + self.chunk_size, total) - 1)
+                           for start in range(0, total, self.chunk_size)]
+            self.written = [end - start + 1 if i in done else 0 for i, (start, end) in enumerate(self.chunks)]
+        if done:
+            self._log(f"Resuming download: {len(done)}/{len(self.chunks)} chunks already on disk")
+        else:
+            with open(self.part_path, "wb") as f:
+                f.truncate(total)
+        self._save_state(etag, done)
+
+        state_lock = threading.Lock()
+
+        def fetch_chunk(index):
+            self._fetch_range(index)
+            with state_lock:
+                done.add(index)
+                self._save_state(etag, done)
+
+        pending = [i for i in range(len(self.chunks)) if i not in done]
+        with ThreadPoolExecutor(max_workers=self.connections) as pool:
+            for future in [pool.submit(fetch_chunk, i) for i in pending]:  # lowest offsets first
+                future.result()
+
+    @retry(
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        stop=stop_after_attempt(5),
+        retry=retry_if_exception(retry_if_transient_error)
+    )
+    def _fetch_range(self, index):
+        start, end = self.chunks[index]
+        with self.cond:
+            self.written[index] = 0  # a retry starts the chunk over
+        resp = safe_get(self.url, stream=True, headers={"Range": f"bytes={start}-{end}"}, session=self.session)
+        if resp.status_code != 206:
+            resp.close()
+            raise HTTPError(f"Expected 206 for bytes {start}-{end}, got {resp.status_code}", response=resp)
+        with open(self.part_path, "r+b") as f:
+            f.seek(start)
+            for block in resp.iter_content(WRITE_BUFFER_SIZE):
+                f.write(block)
+                f.flush()
+                with self.cond:
+                    self.written[index] += len(block)
+                    self.cond.notify_all()
+        if self.written[index] != end - start + 1:
+            raise ChunkedEncodingError(f"Chunk {start}-{end} ended after {self.written[index]} bytes")
+
+    def _run_single(self, total):
+        resp = safe_get(self.url, stream=True, session=self.session)
+        resp.raise_for_status()
+        with self.cond:
+            self.total = total
+            self.chunks = [(0, (total or 2**62) - 1)]
+            self.written = [0]
+        with open(self.part_path, "wb") as f:
+            for block in resp.iter_content(WRITE_BUFFER_SIZE):
+                f.write(block)
+                f.flush()
+                with self.cond:
+                    self.written[0] += len(block)
+                    self.cond.notify_all()
+
+
+class DownloadReader(io.RawIOBase):
+    """
+    Read-only file object over a RangeDownload's file that blocks until the bytes it
+    is asked for have been downloaded. Hashes what it reads, so the checksum of the
+    whole archive is known once the tar stream has been consumed.
+    """
+    def __init__(self, download: RangeDownload):
+        self.download = download
+        self.pos = 0
+        self.sha256 = hashlib.sha256()
+        self.download.wait_for(1)  # the '.part' exists once the first bytes are in
+        self.f = open(download.part_path, "rb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        available = self.download.wait_for(self.pos + 1)
+        if available <= self.pos:
+            return 0
+        data = self.f.read(min(len(b), available - self.pos))
+        b[:len(data)] = data
+        self.sha256.update(data)
+        self.pos += len(data)
+        return len(data)
+
+    def drain(self):
+        # the tar stream may end before the gzip padding; hash the rest too
+        while self.readinto(bytearray(WRITE_BUFFER_SIZE)):
+            pass
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def _inside(path, root) -> bool:
+    # commonpath, not startswith: 'models2/x' is not inside 'models'
+    try:
+        return os.path.commonpath([path, root]) == root
+    except ValueError:  # different drives on Windows
+        return False
+
+
+def _member_dest(member, root) -> str | None:
+    """
+    Where member would be written under root, or None if it must not be extracted:
+    absolute names, '..' escapes, anything routed out through an already extracted
+    symlink, links pointing outside root, and device/fifo entries.
+    """
+    name = member.name.replace("\\", "/")
+    if not name or name.startswith("/") or os.path.splitdrive(name)[0] or member.isdev():
+        return None
+    dest = os.path.join(root, *name.split("/"))
+    parent = os.path.realpath(os.path.dirname(dest))
+    if not _inside(parent, root):
+        return None
+    dest = os.path.join(parent, os.path.basename(dest))
+    if member.issym():
+        link = member.linkname.replace("\\", "/")
+        if link.startswith("/") or os.path.splitdrive(link)[0]:
+            return None
+        if not _inside(os.path.realpath(os.path.join(parent, link)), root):
+            return None
+    elif member.islnk():
+        # hard links name an earlier member, relative to the archive root
+        if not _inside(os.path.realpath(os.path.join(root, member.linkname)), root):
+            return None
+    return dest
+
+
+def extract_tar_stream(fileobj, target_dir, logger: Logger = None) -> dict:
+    """
+    Extract a gzipped tar in one pass over fileobj: each member is checked with
+    _member_dest and written as soon as its header is read, so nothing is held but the
+    current member and extraction can run on a file that is still downloading.
+    Unsafe members are skipped and logged. Returns counts, bytes written and seconds.
+    """
+    start = time.perf_counter()
+    root = os.path.realpath(target_dir)
+    os.makedirs(root, exist_ok=True)
+    stats = {"members": 0, "skipped": 0, "bytes": 0}
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            dest = _member_dest(member, root)
+            if dest is None:
+                stats["skipped"] += 1
+                if logger:
+                    logger.log_status(f"Skipping unsafe archive member {member.name!r}")
+                continue
+            if member.isdir():
+                os.makedirs(dest, exist_ok=True)
+            elif member.isfile():
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                with tar.extractfile(member) as src, open(dest, "wb") as dst:
+                    shutil.copyfileobj(src, dst, WRITE_BUFFER_SIZE)
+                stats["bytes"] += member.size
+            elif member.islnk():
+                # the target was extracted earlier in the stream; a copy works on every filesystem
+                target = os.path.join(root, member.linkname)
+                if not os.path.isfile(target):
+                    stats["skipped"] += 1
+                    continue
+                shutil.copyfile(target, dest)
+            elif member.issym():
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                try:
+                    os.symlink(member.linkname, dest)
+                except OSError:  # Windows without symlink privilege
+                    target = os.path.join(os.path.dirname(dest), member.linkname)
+                    if os.path.isfile(target):
+                        shutil.copyfile(target, dest)
+            stats["members"] += 1
+    stats["seconds"] = time.perf_counter() - start
+    return stats
 
+
+def sha256_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(WRITE_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _install_extracted(staging, target_dir):
+    # move the verified tree into place, replacing what an earlier model left there
+    for name in os.listdir(staging):
+        dest = os.path.join(target_dir, name)
+        if os.path.isdir(dest) and not os.path.islink(dest):
+            shutil.rmtree(dest)
+        elif os.path.lexists(dest):
+            os.remove(dest)
+        os.replace(os.path.join(staging, name), dest)
+
+
+def download_model(logger: Logger, config: Config, model_name = 'faster_rcnn'):
+    """
+    Download the model archive over parallel Range requests (resuming a previous '.part')
+    and extract it while it downloads. If model_data has a 'sha256' for the model, the
+    archive is verified against it. Extraction goes to a temporary sibling of the model
+    folder and is moved in only once the download is complete and verified, so a bad
+    archive never leaves a loadable half-model behind.
+    """
     MODEL_DIR = config.get_model_save_folder()
     model_data = config.get_model_data()
     MODEL_URL = model_data[model_name]['url']
+    expected_sha256 = model_data[model_name].get('sha256')
 
     #MODEL_DIR, MODEL_URL = config.get_model_dwld()
     print(MODEL_DIR)
     os.makedirs(MODEL_DIR, exist_ok=True)
     MODEL_PATH = os.path.join(MODEL_DIR, "model.tar.gz")
-    logger.log_status(f"Downloading model from {MODEL_URL} to {MODEL_PATH}...")
-    
-    response = safe_get(MODEL_URL, stream=True)
-    
-    if response.status_code == 200:
-        tmp_path = MODEL_PATH + ".part"
-        with open(tmp_path, "wb") as f:
-            for chunk in response.iter_content(1024):
-                if chunk:
-                    f.write(chunk)
-        os.replace(tmp_path, MODEL_PATH)
-        logger.log_status("Download complete.")
+
+    if os.path.exists(MODEL_PATH) and expected_sha256 and sha256_file(MODEL_PATH) == expected_sha256:
+        logger.log_status(f"{MODEL_PATH} already downloaded and verified")
+        download = None
+        source = open(MODEL_PATH, "rb")
     else:
-        logger.log_exception(f"Failed to download. HTTP Status Code: {response.status_code}")
-        response.raise_for_status()
-        return
+        logger.log_status(f"Downloading model from {MODEL_URL} to {MODEL_PATH}...")
+        download = RangeDownload(MODEL_URL, MODEL_PATH, logger=logger).start()
+        try:
+            source = DownloadReader(download)
+        except Exception as e:
+            logger.log_exception(f"Failed to download: {e}")
+            return
 
-    # Extract model
+    # Extract model while it downloads
     logger.log_status("Extracting model...")
+    staging = tempfile.mkdtemp(prefix=".extracting-", dir=os.path.dirname(os.path.abspath(MODEL_DIR)))
     try:
-        with tarfile.open(MODEL_PATH, "r:gz") as tar:
-            safe_members = [m for m in tar.getmembers() if is_safe(m, MODEL_DIR)]
-            tar.extractall(MODEL_DIR, members=safe_members)
+        with source:
+            stats = extract_tar_stream(source, staging, logger)
+            if download:
+                source.drain()
+        logger.log_status(f"Extracted {stats['members']} members ({stats['bytes'] / 2**20:.0f} MB, "
+                          f"{stats['skipped']} skipped) in {stats['seconds']:.1f} s")
+        if download:
+            download.join()
+            logger.log_status("Download complete.")
+            checksum = source.sha256.hexdigest()
+            if expected_sha256 and checksum != expected_sha256:
+                os.remove(MODEL_PATH)
+                logger.log_exception(f"Checksum mismatch for {MODEL_PATH}: expected {expected_sha256}, got {checksum}")
+                return
+            logger.log_status(f"sha256 {checksum}")
+        _install_extracted(staging, MODEL_DIR)
         logger.log_status(f"Model extracted successfully to {os.path.abspath('.') + str(MODEL_DIR)}.")
     except Exception as e:
         logger.log_exception(f"An exception occured while extracting model: {e}")
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _getmembers_extract(path, target_dir):
+    # the previous approach, kept for benchmark_extraction: list every member, then extract
+    root = os.path.realpath(target_dir)
+    with tarfile.open(path, "r:gz") as tar:
+        members = [m for m in tar.getmembers() if _member_dest(m, root)]
+        tar.extractall(target_dir, members=members)
+
+
+def benchmark_extraction(archive_path):
+    """
+    Extraction time and peak Python heap (tracemalloc) for getmembers() + extractall
+    against extract_tar_stream, each into a fresh temporary folder.
+    """
+    import tempfile
+    import tracemalloc
+    results = {}
+    for variant in ("getmembers", "stream"):
+        with tempfile.TemporaryDirectory() as target:
+            tracemalloc.start()
+            start = time.perf_counter()
+            if variant == "getmembers":
+                _getmembers_extract(archive_path, target)
+            else:
+                with open(archive_path, "rb") as f:
+                    extract_tar_stream(f, target)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        results[variant] = (seconds, peak)
+        print(f"{variant:<10} {seconds:7.2f} s   {peak:8.1f} MB peak heap")
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    logger = Logger(__name__)
+    archive = sys.argv[1] if len(sys.argv) > 1 else os.path.join(Config(logger).get_model_save_folder(), "model.tar.gz")
+    benchmark_extraction(archive)
@@ -0,0 +1,91 @@
+import time
+import asyncio
+import threading
+
+
+class RateLimitedError(Exception):
+    """Raised when the API answers 429 or OVER_QUERY_LIMIT, so the caller's retry kicks in."""
+
+
+class TokenBucket:
+    """
+    Blocking token bucket with AIMD rate control.
+    acquire() reserves the next token and sleeps exactly until it is due, so waiters
+    never poll. on_throttled() halves the rate (at most once per second) when the API
+    answers 429 or OVER_QUERY_LIMIT; on_success() grows it back by increase_per_min
+    for every second without throttling, up to max_per_min.
+    """
+    def __init__(self, max_per_min, min_per_min=60, increase_per_min=None, burst=None):
+        self.max_rate = max_per_min / 60.0
+        self.min_rate = min(min_per_min, max_per_min) / 60.0
+        self.increase = (increase_per_min or max_per_min / 20) / 60.0
+        self.rate = self.max_rate
+        self.capacity = burst or max(1.0, self.max_rate)  # one second worth of calls
+        self.tokens = self.capacity
+        self.lock = threading.Lock()
+        self.last = time.monotonic()
+        self.last_increase = self.last
+        self.last_decrease = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self) -> float:
+        """
+        Take one token and return how many seconds the caller has to wait before using it.
+        Tokens may go negative; later callers queue up behind the debt in arrival order.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_throttled(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < 1.0:
+                return  # a burst of 429s from one overshoot counts once
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)  # drop banked tokens so the cut applies at once
+            self.last_decrease = self.last_increase = now
+
+    def on_success(self):
+        with self.lock:
+            if self.rate >= self.max_rate:
+                return
+            now = time.monotonic()
+            elapsed = now - self.last_increase
+            if elapsed >= 1.0:
+                self._refill(now)
+                self.rate = min(self.max_rate, self.rate + self.increase * elapsed)
+                self.last_increase = now
+
+    def rate_per_min(self) -> float:
+        return self.rate * 60.0
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name: str, max_per_min: float, burst=None) -> TokenBucket:
+    """
+    Returns the process-wide bucket for name, creating it on first use.
+    Callers hitting the same quota share one name so they are throttled together.
+    burst (default: one second worth of calls) only applies when the bucket is created.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = TokenBucket(max_per_min, burst=burst)
+        return _limiters[name]
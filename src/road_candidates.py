@@ -0,0 +1,120 @@
+# Candidate scan points sampled along roads from a local OSM extract
+# Usage:
+#   for lat, lon in road_candidates('aizawl_roads.geojson', north, south, east, west, spacing_m=20):
+#       ...
+# Works offline. GeoJSON (LineString / MultiLineString features) is read directly;
+# .osm.pbf extracts need the optional 'osmium' package.
+
+import json
+import math
+from pathlib import Path
+
+EARTH_RADIUS_M = 6371000.0
+
+# Ways that Street View cars drive; footpaths, cycleways and steps are skipped
+ROAD_TYPES = {
+    "motorway", "trunk", "primary", "secondary", "tertiary",
+    "motorway_link", "trunk_link", "primary_link", "secondary_link", "tertiary_link",
+    "unclassified", "residential", "living_street", "service", "road",
+}
+
+
+def _load_geojson(path: Path) -> list[list[tuple[float, float]]]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    features = data.get("features", []) if data.get("type") == "FeatureCollection" else [data]
+    lines = []
+    for feature in features:
+        highway = (feature.get("properties") or {}).get("highway")
+        if highway is not None and highway not in ROAD_TYPES:
+            continue
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "LineString":
+            parts = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiLineString":
+            parts = geometry["coordinates"]
+        else:
+            continue
+        for part in parts:
+            # GeoJSON positions are [lon, lat]
+            lines.append([(float(p[1]), float(p[0])) for p in part])
+    return lines
+
+
+def _load_pbf(path: Path) -> list[list[tuple[float, float]]]:
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Reading .osm.pbf extracts needs the 'osmium' package; "
+                          "install it or export the roads as GeoJSON") from e
+
+    class RoadHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.lines = []
+
+        def way(self, w):
+            if w.tags.get("highway") not in ROAD_TYPES:
+                return
+            try:
+                self.lines.append([(n.lat, n.lon) for n in w.nodes])
+            except osmium.InvalidLocationError:
+                pass  # way partly outside the extract
+
+    handler = RoadHandler()
+    handler.apply_file(str(path), locations=True)
+    return handler.lines
+
+
+def load_road_lines(path) -> list[list[tuple[float, float]]]:
+    """
+    Road polylines as lists of (lat, lon) from a GeoJSON or OSM PBF file on disk.
+    """
+    path = Path(path)
+    if path.name.lower().endswith(".pbf"):
+        return _load_pbf(path)
+    return _load_geojson(path)
+
+
+def _distance_m(a, b) -> float:
+    # Equirectangular approximation; plenty for road segments a few hundred metres long
+    mean_lat = math.radians((a[0] + b[0]) / 2)
+    dy = math.radians(b[0] - a[0])
+    dx = math.radians(b[1] - a[1]) * math.cos(mean_lat)
+    return EARTH_RADIUS_M * math.hypot(dx, dy)
+
+
+def sample_polyline(line, spacing_m: float) -> list[tuple[float, float]]:
+    """
+    Points every spacing_m metres along the polyline, starting at its first vertex.
+    """
+    if not line:
+        return []
+    points = [line[0]]
+    carried = 0.0  # distance walked since the last emitted point
+    for a, b in zip(line, line[1:]):
+        seg = _distance_m(a, b)
+        if seg == 0:
+            continue
+        pos = spacing_m - carried
+        while pos <= seg:
+            t = pos / seg
+            points.append((a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t))
+            pos += spacing_m
+        carried = seg - (pos - spacing_m)
+    return points
+
+
+def road_candidates(path, north, south, east, west, spacing_m=20.0):
+    """
+    Yields (lat, lon) sample points on the roads of the extract that fall inside the bbox.
+    """
+    for line in load_road_lines(path):
+        lats = [p[0] for p in line]
+        lons = [p[1] for p in line]
+        if max(lats) < south or min(lats) > north or max(lons) < west or min(lons) > east:
+            continue
+        for lat, lon in sample_polyline(line, spacing_m):
+            if south <= lat <= north and west <= lon <= east:
+                yield lat, lon
@@ -0,0 +1,48 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(__file__), os.pardir, "src")
+
+# the app runs from src/ with its modules imported flat
+sys.path.insert(0, SRC)
+
+_APP_LOG = os.path.join(SRC, "app_logs.json")
+_app_log = None
+
+
+def pytest_sessionstart(session):
+    # modules log to src/app_logs.json on import; keep test runs out of the shipped log
+    global _app_log
+    if os.path.exists(_APP_LOG):
+        with open(_APP_LOG, "rb") as f:
+            _app_log = f.read()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if _app_log is not None:
+        with open(_APP_LOG, "wb") as f:
+            f.write(_app_log)
+
+
+@pytest.fixture
+def serve():
+    """
+    serve(handler_class) starts a local HTTP server on a free port and returns its base URL;
+    every server is shut down after the test.
+    """
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import crop_engine
+
+
+@pytest.fixture
+def panorama(tmp_path):
+    # baseline 4:2:0 JPEG whose height is not a multiple of the MCU, like a real panorama band
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (1031, 2048, 3), dtype=np.uint8), (9, 9), 3)
+    path = tmp_path / "pano.jpg"
+    cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return path
+
+
+def _full(path):
+    with Image.open(path) as im:
+        return np.asarray(im.convert("RGB"))
+
+
+@pytest.mark.parametrize("rows", [1, 17, 600, 1030, 1031])
+def test_top_rows_match_full_decode(panorama, rows):
+    band = crop_engine._decode_top_rows(str(panorama), rows)
+    assert band.size == (2048, rows)
+    assert np.array_equal(np.asarray(band.convert("RGB")), _full(panorama)[:rows])
+
+
+def test_corrupt_band_matches_full_decode_or_raises(panorama, tmp_path):
+    data = bytearray(panorama.read_bytes())
+    for n, junk in enumerate((b"\x00" * 64, bytes(range(256)) * 2)):
+        corrupt = tmp_path / f"corrupt_{n}.jpg"
+        damaged = bytearray(data)
+        damaged[len(data) // 10:len(data) // 10 + len(junk)] = junk
+        corrupt.write_bytes(damaged)
+        try:
+            band = np.asarray(crop_engine._decode_top_rows(str(corrupt), 600).convert("RGB"))
+        except OSError:
+            continue  # crop_file falls back to a full decode
+        assert np.array_equal(band, _full(corrupt)[:600])
+
+
+def test_truncated_file_falls_back_to_full_decode(panorama, tmp_path):
+    truncated = tmp_path / "truncated.jpg"
+    truncated.write_bytes(panorama.read_bytes()[:len(panorama.read_bytes()) // 3])
+    with pytest.raises(OSError):
+        crop_engine._decode_top_rows(str(truncated), 1000)
+    result = crop_engine.crop_file(truncated, tmp_path, (2048, 1031), 31, method="partial")
+    assert result["success"] and len(result["saved_files"]) == 2
+
+
+def test_partial_crop_matches_full_crop(panorama, tmp_path):
+    partial, full = tmp_path / "partial", tmp_path / "full"
+    partial.mkdir(), full.mkdir()
+    for method, folder in (("partial", partial), ("full", full)):
+        assert crop_engine.crop_file(panorama, folder, (2048, 1031), 431, method=method)["success"]
+    for name in ("pano_(0, 0).jpg", "pano_(0, 1).jpg"):
+        a, b = cv2.imread(str(partial / name)), cv2.imread(str(full / name))
+        assert a.shape == b.shape == (600, 1024, 3)
+        # both re-encode at JPEG_QUALITY; PIL and OpenCV decode the source the same way
+        assert np.abs(a.astype(int) - b).mean() < 1.0
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from tenacity import wait_none
+
+from metadata_client import AsyncMetadataClient
+from rate_limiter import TokenBucket
+
+
+class MetadataStub(BaseHTTPRequestHandler):
+    """
+    /streetview/metadata answering with the requested location as pano_id. Locations listed
+    in fail_first get one 500 (or 429 / OVER_QUERY_LIMIT) before the real answer.
+    """
+    fail_first = {}
+    calls = {}
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+    delay = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        location = parse_qs(urlparse(self.path).query)["location"][0]
+        cls = type(self)
+        with cls.lock:
+            cls.calls[location] = cls.calls.get(location, 0) + 1
+            first = cls.calls[location] == 1
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            if cls.delay:
+                threading.Event().wait(cls.delay)
+            failure = cls.fail_first.get(location) if first else None
+            if failure in (500, 429):
+                self._reply(failure, {})
+            elif failure == "OVER_QUERY_LIMIT":
+                self._reply(200, {"status": "OVER_QUERY_LIMIT"})
+            else:
+                self._reply(200, {"status": "OK", "pano_id": location})
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub(serve, monkeypatch):
+    handler = type("Stub", (MetadataStub,), {"fail_first": {}, "calls": {}, "lock": threading.Lock()})
+    monkeypatch.setattr(AsyncMetadataClient.fetch.retry, "wait", wait_none())
+    return handler, serve(handler) + "/streetview/metadata"
+
+
+def _fetch_all(url, points, **kwargs):
+    async def run():
+        async with AsyncMetadataClient("key", base_url=url, **kwargs) as client:
+            return await asyncio.gather(*(client.fetch(lat, lon) for lat, lon in points))
+    return asyncio.run(run())
+
+
+def test_results_come_back_in_request_order(stub):
+    handler, url = stub
+    handler.delay = 0.01
+    points = [(i * 0.001, 92.7) for i in range(30)]
+    results = _fetch_all(url, points, max_concurrency=8)
+    assert [r["pano_id"] for r in results] == [f"{lat},{lon}" for lat, lon in points]
+    assert handler.max_in_flight <= 8
+
+
+def test_transient_errors_are_retried(stub):
+    handler, url = stub
+    handler.fail_first = {"1,2": 500, "3,4": 429, "5,6": "OVER_QUERY_LIMIT"}
+    limiter = TokenBucket(6000)
+    results = _fetch_all(url, [(1, 2), (3, 4), (5, 6), (7, 8)], rate_limiter=limiter)
+    assert [r["status"] for r in results] == ["OK"] * 4
+    assert handler.calls == {"1,2": 2, "3,4": 2, "5,6": 2, "7,8": 1}
+    # 429 and OVER_QUERY_LIMIT shrink the shared rate
+    assert limiter.rate_per_min() < 6000
@@ -0,0 +1,167 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from tenacity import stop_after_attempt, wait_none
+
+import model_download
+from model_download import RangeDownload, download_model
+from rate_limiter import TokenBucket
+
+CHUNK = 64 * 1024
+
+
+def make_archive() -> bytes:
+    rng = __import__("random").Random(0)
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w:gz") as tar:
+        for name, size in (("saved_model/saved_model.pb", 50_000), ("saved_model/variables/v.data", 400_000)):
+            data = bytes(rng.getrandbits(8) for _ in range(size))
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+PAYLOAD = make_archive()
+
+
+class ArchiveStub(BaseHTTPRequestHandler):
+    """
+    Serves PAYLOAD with Range support (ranges=False ignores Range headers). After fail_after
+    requests every Range request answers 503, like a host going away mid-download.
+    """
+    ranges = True
+    fail_after = None
+    requests = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        header = self.headers.get("Range")
+        with cls.lock:
+            cls.requests.append(header)
+            count = len(cls.requests)
+        match = header and re.match(r"bytes=(\d+)-(\d+)", header)
+        if match and cls.ranges:
+            if cls.fail_after is not None and count > cls.fail_after:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = int(match[1]), min(int(match[2]), len(PAYLOAD) - 1)
+            body = PAYLOAD[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+            self.send_header("ETag", '"v1"')
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub(serve, monkeypatch):
+    handler = type("Stub", (ArchiveStub,), {"requests": [], "lock": threading.Lock()})
+    monkeypatch.setattr(model_download, "rate_limiter", TokenBucket(600_000))
+    monkeypatch.setattr(model_download.safe_get.retry, "wait", wait_none())
+    monkeypatch.setattr(RangeDownload._fetch_range.retry, "wait", wait_none())
+    return handler, serve(handler) + "/model.tar.gz"
+
+
+def chunk_ranges(requests):
+    return [r for r in requests if r and r != "bytes=0-0"]
+
+
+def test_range_download_fetches_every_chunk_in_order(stub, tmp_path):
+    handler, url = stub
+    path = str(tmp_path / "model.tar.gz")
+    RangeDownload(url, path, connections=1, chunk_size=CHUNK).start().join()
+    assert open(path, "rb").read() == PAYLOAD
+    assert not os.path.exists(path + ".part") and not os.path.exists(path + ".part.json")
+    starts = [int(re.match(r"bytes=(\d+)-", r)[1]) for r in chunk_ranges(handler.requests)]
+    assert starts == list(range(0, len(PAYLOAD), CHUNK))  # lowest offsets first
+
+
+def test_interrupted_download_resumes_with_missing_chunks_only(stub, tmp_path, monkeypatch):
+    handler, url = stub
+    monkeypatch.setattr(RangeDownload._fetch_range.retry, "stop", stop_after_attempt(1))
+    monkeypatch.setattr(model_download.safe_get.retry, "stop", stop_after_attempt(1))
+    path = str(tmp_path / "model.tar.gz")
+    chunks = -(-len(PAYLOAD) // CHUNK)
+
+    handler.fail_after = 3  # probe + 2 chunks
+    with pytest.raises(Exception):
+        RangeDownload(url, path, connections=1, chunk_size=CHUNK).start().join()
+    with open(path + ".part.json", encoding="utf-8") as f:
+        done = json.load(f)["done"]
+    assert done == [0, 1]
+
+    handler.fail_after = None
+    handler.requests.clear()
+    RangeDownload(url, path, connections=2, chunk_size=CHUNK).start().join()
+    assert open(path, "rb").read() == PAYLOAD
+    assert len(chunk_ranges(handler.requests)) == chunks - len(done)
+    assert f"bytes=0-{CHUNK - 1}" not in handler.requests
+
+
+def test_servers_without_range_support_get_one_stream(stub, tmp_path):
+    handler, url = stub
+    handler.ranges = False
+    path = str(tmp_path / "model.tar.gz")
+    RangeDownload(url, path, chunk_size=CHUNK).start().join()
+    assert open(path, "rb").read() == PAYLOAD
+    assert len(handler.requests) == 2  # probe (answered 200) + one full GET
+
+
+class Log:
+    def __init__(self):
+        self.errors = []
+
+    def log_status(self, msg, status="INFO"):
+        pass
+
+    def log_exception(self, msg):
+        self.errors.append(msg)
+
+
+class ModelConfig:
+    def __init__(self, url, folder, sha256):
+        self.url, self.folder, self.sha256 = url, folder, sha256
+
+    def get_model_save_folder(self):
+        return self.folder
+
+    def get_model_data(self):
+        return {"faster_rcnn": {"url": self.url, "sha256": self.sha256}}
+
+
+def test_download_model_extracts_verified_archive(stub, tmp_path):
+    _, url = stub
+    folder = str(tmp_path / "faster_rcnn")
+    log = Log()
+    download_model(log, ModelConfig(url, folder, hashlib.sha256(PAYLOAD).hexdigest()))
+    assert not log.errors
+    assert os.path.getsize(os.path.join(folder, "saved_model", "variables", "v.data")) == 400_000
+    assert [p for p in os.listdir(tmp_path) if p.startswith(".extracting-")] == []
+
+
+def test_checksum_mismatch_leaves_no_model_behind(stub, tmp_path):
+    _, url = stub
+    folder = str(tmp_path / "faster_rcnn")
+    log = Log()
+    download_model(log, ModelConfig(url, folder, "0" * 64))
+    assert any("Checksum mismatch" in e for e in log.errors)
+    assert os.listdir(folder) == []
+    assert [p for p in os.listdir(tmp_path) if p.startswith(".extracting-")] == []
@@ -0,0 +1,83 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+import pytest
+from tenacity import wait_none
+
+import Tile_Downloader
+from Tile_Downloader import TileSource, fetch_panorama_tiles
+
+TILE = 32
+
+
+def tile_colour(x, y):
+    return (10 + 30 * x, 20 + 60 * y, 200)  # BGR, distinct per tile of the 8 x 4 grid
+
+
+class TileStub(BaseHTTPRequestHandler):
+    """
+    cbk-style tile endpoint: a solid JPEG per (x, y). Tiles in missing answer 404; tiles in
+    flaky answer 503 on their first request.
+    """
+    missing = set()
+    flaky = set()
+    calls = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        x, y = int(query["x"][0]), int(query["y"][0])
+        cls = type(self)
+        with cls.lock:
+            cls.calls[(x, y)] = cls.calls.get((x, y), 0) + 1
+            first = cls.calls[(x, y)] == 1
+        if (x, y) in cls.missing or ((x, y) in cls.flaky and first):
+            self.send_response(404 if (x, y) in cls.missing else 503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        tile = np.empty((TILE, TILE, 3), dtype=np.uint8)
+        tile[:] = tile_colour(x, y)
+        data = cv2.imencode(".png", tile)[1].tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub(serve, monkeypatch):
+    handler = type("Stub", (TileStub,), {"missing": set(), "flaky": set(), "calls": {}, "lock": threading.Lock()})
+    monkeypatch.setattr(Tile_Downloader.safe_get.retry, "wait", wait_none())
+    return handler, TileSource(base_url=serve(handler) + "/cbk", tile_size=TILE)
+
+
+def test_tiles_land_in_their_grid_cells(stub):
+    handler, source = stub
+    canvas = fetch_panorama_tiles("pano", zoom=3, source=source)
+    cols, rows = source.grid(3)
+    assert canvas.shape == (rows * TILE, cols * TILE, 3)
+    for y in range(rows):
+        for x in range(cols):
+            cell = canvas[y * TILE:(y + 1) * TILE, x * TILE:(x + 1) * TILE]
+            assert (cell == tile_colour(x, y)).all()
+    assert all(n == 1 for n in handler.calls.values()) and len(handler.calls) == cols * rows
+
+
+def test_missing_tiles_stay_black_and_server_errors_are_retried(stub):
+    handler, source = stub
+    handler.missing = {(7, 3)}
+    handler.flaky = {(0, 0), (5, 2)}
+    canvas = fetch_panorama_tiles("pano", zoom=3, source=source, workers=2)
+    assert not canvas[3 * TILE:, 7 * TILE:].any()
+    assert (canvas[:TILE, :TILE] == tile_colour(0, 0)).all()
+    assert (canvas[2 * TILE:3 * TILE, 5 * TILE:6 * TILE] == tile_colour(5, 2)).all()
+    assert handler.calls[(0, 0)] == handler.calls[(5, 2)] == 2
+    assert handler.calls[(7, 3)] == 1  # 404 is not retried